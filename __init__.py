@@ -1,11 +1,36 @@
 """The Detailed Hello World Push integration."""
 from __future__ import annotations
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import time
 
+import voluptuous as vol
 from homeassistant.config_entries import ConfigEntry,ConfigEntryNotReady,ConfigEntryAuthFailed
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
+from homeassistant.exceptions import HomeAssistantError
+import homeassistant.helpers.config_validation as cv
 
 from .hub import Hub
-from .const import DOMAIN
+from .ptsp01telnet import SessionRecorder, setSwitchesMany
+from .const import DOMAIN, SERVICE_PROFILE, SERVICE_SET_SWITCHES, SWITCH_CONCURRENCY
+
+_LOGGER = logging.getLogger(__name__)
+PROFILE_SCHEMA = vol.Schema({
+    vol.Optional("duration", default=30): vol.All(vol.Coerce(float), vol.Range(min=1, max=3600)),
+    vol.Optional("record", default=False): cv.boolean,
+})
+SET_SWITCHES_SCHEMA = vol.Schema({
+    vol.Required("targets"): vol.All(cv.ensure_list, [vol.Schema({
+        vol.Required("strip"): cv.string,       # custom id or host of the strip
+        vol.Required("socket"): vol.All(vol.Coerce(int), vol.Range(min=1)),
+        vol.Required("state"): cv.boolean,
+    })]),
+    vol.Optional("timeout", default=10): vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+})
 
 # List of platforms to support. There should be a matching .py file for each,
 # eg <cover.py> and <sensor.py>
@@ -17,8 +42,22 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # Store an instance of the "connecting" class that does the work of speaking
     # with your actual devices.
     hub=Hub(hass, entry.data)
+    # partial keeps the handlers recognisable as coroutine functions, a lambda would run as an executor job
+    if not hass.services.has_service(DOMAIN, SERVICE_PROFILE):
+        hass.services.async_register(DOMAIN, SERVICE_PROFILE, functools.partial(async_profile, hass), PROFILE_SCHEMA)
+    if not hass.services.has_service(DOMAIN, SERVICE_SET_SWITCHES):
+        hass.services.async_register(DOMAIN, SERVICE_SET_SWITCHES, functools.partial(async_set_switches, hass), SET_SWITCHES_SCHEMA,
+                                     supports_response=SupportsResponse.OPTIONAL)
     # This creates each HA object for each platform your device requires.
     # It's done by calling the `async_setup_entry` function in each platform module.
+    if await hub.restore():
+        # Readings saved before the restart are shown right away, the connection follows
+        hass.data.setdefault(DOMAIN, {})[entry.entry_id] = hub
+        await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+        await hub.startStatistics()
+        entry.async_create_background_task(hass, hub.setupInBackground(entry), f"{DOMAIN} setup {hub._host}")
+        hub.startSnapshots()
+        return True
     try:
         await hub.setup()
         hass.data.setdefault(DOMAIN, {})[entry.entry_id] = hub
@@ -27,6 +66,8 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         raise ConfigEntryAuthFailed(f"Invalid password for {hub._host}") from ex
     except (EOFError,OSError,ConnectionError,BrokenPipeError) as ex:
         raise ConfigEntryNotReady(f"Failed connecting to {hub._host}") from ex
+    await hub.startStatistics()
+    hub.startSnapshots()
     return True
 
 
@@ -37,5 +78,90 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # details
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        hub:Hub = hass.data[DOMAIN].pop(entry.entry_id)
+        await hub.close()
     return unload_ok
+
+
+async def async_set_switches(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    """Switch many outlets: one round trip per strip, the strips in parallel.
+
+    Each target is reported in the order given; a repeated strip and socket is rejected, the first one wins.
+    """
+    hubs: dict[str, Hub] = {}
+    for hub in hass.data.get(DOMAIN, {}).values():
+        hubs[hub._id] = hubs[hub._host] = hub
+    grouped: dict[Hub, dict[int, int]] = {}
+    positions: dict[Hub, dict[int, int]] = {}
+    targets = call.data["targets"]
+    results: list[dict | None] = [None] * len(targets)
+    for index, target in enumerate(targets):
+        hub = hubs.get(target["strip"])
+        if hub is None or target["socket"] > hub.strip.sockets:
+            results[index] = {**target, "ok": False, "error": "Unknown strip or socket"}
+        elif target["socket"] in grouped.get(hub, {}):
+            results[index] = {**target, "ok": False, "error": "Duplicate target"}
+        else:
+            grouped.setdefault(hub, {})[target["socket"]] = 1 if target["state"] else 0
+            positions.setdefault(hub, {})[target["socket"]] = index
+    started = time.monotonic()
+    outcomes = await setSwitchesMany([(hub.strip, switches) for hub, switches in grouped.items()],
+                                     SWITCH_CONCURRENCY, call.data["timeout"])
+    for (hub, switches), (outcome, seconds) in zip(grouped.items(), outcomes):
+        for socket, switch in switches.items():
+            result = {"strip": hub._id, "socket": socket, "state": switch == 1, "seconds": round(seconds, 3)}
+            if isinstance(outcome, Exception):
+                result.update(ok=False, error=str(outcome) or type(outcome).__name__)
+            else:
+                result["ok"] = outcome[socket]
+            results[positions[hub][socket]] = result
+    return {"results": results, "seconds": round(time.monotonic() - started, 3)}
+
+
+async def async_profile(hass: HomeAssistant, call: ServiceCall) -> None:
+    """Profile the event loop for the given duration and write the report to the config directory.
+
+    Everything running on the loop is captured, the report lists this
+    integration's functions first, then the overall top entries. With
+    record, each strip's byte stream is saved next to it for replay.
+    """
+    profiling = hass.data.setdefault(DOMAIN+"_profiling", {})
+    if profiling.get("active"):
+        raise HomeAssistantError("A profile is already running")
+    profiling["active"] = True
+    duration = call.data["duration"]
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    hubs:list[Hub] = list(hass.data.get(DOMAIN, {}).values())
+    profiler = cProfile.Profile()
+    try:
+        if call.data["record"]:
+            for hub in hubs:
+                hub.strip.recorder = await hass.async_add_executor_job(
+                    SessionRecorder, hass.config.path(f"{DOMAIN}_{hub._id}_{stamp}.rec"))
+        profiler.enable()
+        await asyncio.sleep(duration)
+    finally:
+        profiler.disable()
+        profiling["active"] = False
+        for hub in hubs:
+            recorder, hub.strip.recorder = hub.strip.recorder, None
+            if recorder is not None:
+                await hass.async_add_executor_job(recorder.close)
+    path = hass.config.path(f"{DOMAIN}_profile_{stamp}.txt")
+    await hass.async_add_executor_job(writeProfile, path, profiler, duration, hubs)
+    _LOGGER.info("Wrote profile of %.0fs to %s", duration, path)
+
+def writeProfile(path: str, profiler: cProfile.Profile, duration: float, hubs: list[Hub]):
+    report = io.StringIO()
+    report.write(f"Profile of {duration:.0f}s, {len(hubs)} powerstrips\n")
+    for hub in hubs:
+        metrics = hub.strip.metrics
+        report.write(f"{hub._host}: {metrics.lines} lines, {metrics.bytes_received} bytes, "
+                     f"poll round trip mean {metrics.poll_rtt.mean}, p95 {metrics.poll_rtt.quantile(0.95)}\n")
+    stats = pstats.Stats(profiler, stream=report)
+    report.write("\n== ptsp01_powerstrip, by cumulative time ==\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(r"ptsp01|hub\.py|sensor\.py|switch\.py", 60)
+    report.write("\n== everything, by own time ==\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(40)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(report.getvalue())
@@ -0,0 +1,78 @@
+"""Throughput of the receive-side line framer on a large replayed session.
+
+    python benchmarks/bench_framer.py [polls]
+
+Compares ptsp01telnet.LineFramer with the previous decode/concatenate/split
+approach of ptsp01.read()/getMsg(). For output with no line end the framer
+gets a buffer large enough to keep every byte, as the old code did.
+"""
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),".."))
+from ptsp01telnet import PROMPT,LineFramer
+from ptsp01sim import MIB_ITEMS,SimulatedStrip
+
+def session(polls:int)->bytes:
+    """A recorded-looking session: echoed poll commands, qmibtree output and prompts."""
+    strip=SimulatedStrip()
+    poll="".join(strip.get(f"Device.SmartPlug.Socket.{socket}.{item}")+"\r\n" for socket in strip.sockets for item in MIB_ITEMS)
+    return (("sh /tmp/readStates.sh\r\n"+poll+PROMPT)*polls).encode()
+
+def chunks(data:bytes,seed:int=1)->list[bytes]:
+    """Split like socket reads do, from single bytes up to full 4 KiB reads."""
+    rng=random.Random(seed)
+    result=[]
+    position=0
+    while position<len(data):
+        size=rng.choice((1,16,64,512,4096))
+        result.append(data[position:position+size])
+        position+=size
+    return result
+
+def unterminated(size:int)->bytes:
+    """Output with no line end at all, e.g. a device stuck at a prompt echoing input."""
+    return b"x"*size
+
+def legacy(reads:list[bytes])->int:
+    stored=""
+    count=0
+    for data in reads:
+        stored=stored+data.decode()
+        if stored.find("\r\n")>-1:
+            spl=stored.split("\r\n")
+            stored=spl[-1]
+            for line in spl[0:-1]:
+                count+=1
+    return count
+
+def framer(reads:list[bytes],max_buffer:int=65536)->int:
+    framer=LineFramer(max_buffer)
+    count=0
+    for data in reads:
+        framer.feed(data)
+        for line in framer.lines():
+            count+=1
+    return count
+
+def run(title:str,data:bytes,max_buffer:int=65536,repeat:int=5):
+    reads=chunks(data)
+    print(f"{title}: {len(data)/1e6:.1f} MB in {len(reads)} reads, best of {repeat}")
+    for name,function in (("legacy str split",legacy),("LineFramer",lambda reads: framer(reads,max_buffer))):
+        elapsed=math.inf
+        for _ in range(repeat):
+            start=time.perf_counter()
+            lines=function(reads)
+            elapsed=min(elapsed,time.perf_counter()-start)
+        print(f"  {name:18} {lines} lines {elapsed:.3f}s {len(data)/elapsed/1e6:.1f} MB/s")
+
+def main(polls:int):
+    run("replayed polls",session(polls))
+    data=unterminated(polls*50)
+    run("no line end",data,len(data),1)
+
+if __name__=="__main__":
+    main(int(sys.argv[1]) if len(sys.argv)>1 else 20000)
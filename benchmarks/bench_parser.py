@@ -0,0 +1,79 @@
+"""Status parser throughput.
+
+    python benchmarks/bench_parser.py [lines]
+
+Compares ptsp01.onMessage with the previous slice/split/json parser on
+qmibtree output as the device prints it. The table parser also feeds the
+time series, the energy integrator and the metrics, which the old one did
+not have. Mutated output is covered by tests/test_parser.py.
+"""
+import json
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),".."))
+from ptsp01telnet import ptsp01
+from ptsp01sim import MIB_ITEMS,SimulatedStrip
+
+def recorded(count:int,sockets:int=12)->list[str]:
+    strip=SimulatedStrip(sockets=sockets)
+    lines=[strip.get(f"Device.SmartPlug.Socket.{socket}.{item}") for socket in range(1,4) for item in MIB_ITEMS]
+    return (lines*(count//len(lines)+1))[:count]
+
+class Parser(ptsp01):
+    def onStatusUpdate(self,socket:int,key:str):
+        pass
+
+def legacy(message:str,states:dict):
+    message=message.replace(" ","")
+    if not message.startswith("Device.SmartPlug.Socket."):
+        return
+    socket=int(message[24])
+    pair=message[26:].split('=')
+    if pair.__len__()<2:
+        return
+    value=pair[1]
+    key=pair[0].split("(")[0]
+    if key==("Switch"):
+        states[socket]["switch"]=value=="1"
+    elif key==("Voltage"):
+        states[socket]["voltage"]=float(value)
+    elif key==("Current"):
+        states[socket]["current"]=float(value)
+    elif key==("Power"):
+        states[socket]["power"]=float(value)
+    elif key==("Energy"):
+        states[socket]["energy"]=float(value)
+    elif key==("EnergyMeter.SingleCount"):
+        data=json.loads(value.replace("'",'"'))
+        if data and "peakenergy" in data and "valleyenergy" in data:
+            states[socket]["energy_meter"]=float(data["peakenergy"])+float(data["valleyenergy"])
+
+def timed(function,repeat:int=5)->float:
+    """Best of repeat runs, the others are disturbed by the rest of the machine."""
+    best=math.inf
+    for _ in range(repeat):
+        start=time.perf_counter()
+        function()
+        best=min(best,time.perf_counter()-start)
+    return best
+
+def benchmark(count:int):
+    lines=recorded(count)
+    def runLegacy():
+        states={i:{} for i in range(1,4)}
+        for line in lines:
+            legacy(line,states)
+    def runTable():
+        parser=Parser("127.0.0.1")
+        parser.in_poll=True     # as in a poll, the readings are published once at the end
+        for line in lines:
+            parser.onMessage(line)
+        parser.publish()
+    print(f"legacy parser  {count/timed(runLegacy)/1e3:.0f}k lines/s")
+    print(f"table parser   {count/timed(runTable)/1e3:.0f}k lines/s")
+
+if __name__=="__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv)>1 else 500000)
@@ -0,0 +1,56 @@
+"""Receive path throughput on a recorded session.
+
+    python benchmarks/bench_replay.py session.rec [--realtime] [--repeat N]
+    python benchmarks/bench_replay.py --record session.rec [polls]
+
+A session is recorded with ptsp01.startRecording, in the field or, with
+--record, against the simulator. Replaying feeds the received bytes
+through onData -> LineFramer -> onLine -> onMessage -> updateState ->
+onStatusUpdate without a device or a socket.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),".."))
+from ptsp01telnet import ptsp01,replay
+from ptsp01sim import SimulatorServer
+
+class Replayed(ptsp01):
+    def onStatusUpdate(self,socket:int,key:str):
+        pass
+
+async def record(path:str,polls:int):
+    server=SimulatorServer()
+    await server.start()
+    strip=ptsp01("127.0.0.1",server.port)
+    strip.startRecording(path)
+    await strip.connect()
+    await strip.waitForLogin()
+    for _ in range(polls):
+        await strip.poll()
+    await strip.close()
+    await server.stop()
+    print(f"recorded {polls} polls to {path}, {os.path.getsize(path)} bytes")
+
+async def benchmark(path:str,realtime:bool,repeat:int):
+    best=None
+    for _ in range(repeat):
+        result=await replay(path,Replayed("127.0.0.1"),realtime)
+        best=result if best is None or result["seconds"]<best["seconds"] else best
+    print(f"{best['reads']} reads, {best['bytes']} bytes, {best['lines']} lines in {best['seconds']:.3f}s: "
+          f"{best['lines']/best['seconds']/1e3:.0f}k lines/s, {best['bytes']/best['seconds']/1e6:.1f} MB/s")
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("session")
+    parser.add_argument("polls",type=int,nargs="?",default=500)
+    parser.add_argument("--record",action="store_true",help="record a session against the simulator first")
+    parser.add_argument("--realtime",action="store_true",help="replay at the recorded pace")
+    parser.add_argument("--repeat",type=int,default=5)
+    args=parser.parse_args()
+    if args.record:
+        asyncio.run(record(args.session,args.polls))
+    else:
+        asyncio.run(benchmark(args.session,args.realtime,1 if args.realtime else args.repeat))
@@ -1,18 +1,24 @@
 """Config flow for Hello World integration."""
 from __future__ import annotations
 
+import ipaddress
 import logging
 from typing import Any, Callable
 
 import voluptuous as vol
 
 from homeassistant import config_entries, exceptions
+from homeassistant.components import network
 from homeassistant.core import HomeAssistant
 
-from .const import CONF_INTERVAL, DOMAIN,CONF_PORT,CONF_HOST,CONF_ID,CONF_PASS
-from .hub import Hub
+from .const import CONF_BATCH, CONF_DEADBAND, CONF_INTERVAL, CONF_MAX_INTERVAL, CONF_MIN_INTERVAL, CONF_PUSH, CONF_SAMPLE, CONF_SAMPLE_INTERVAL, CONF_STATISTICS, DOMAIN,CONF_PORT,CONF_HOST,CONF_ID,CONF_PASS
+from .ptsp01telnet import checkLogin, discover
 
 _LOGGER = logging.getLogger(__name__)
+# Largest scan the discovery step accepts, a /22
+DISCOVERY_MAX_HOSTS = 1024
+DISCOVERY_CONCURRENCY = 64
+DISCOVERY_TIMEOUT = 2.0
 
 # This is the schema that used to display the UI to the user. This simple
 # schema has a single required host field, but it could include a number of fields
@@ -30,7 +36,15 @@ DATA_SCHEMA = vol.Schema({
     vol.Optional(CONF_PORT,default=23): int,
     vol.Optional(CONF_PASS,default=''): str,
     vol.Optional(CONF_ID,default=''): str,
-    vol.Optional(CONF_INTERVAL,default=30): int,})
+    vol.Optional(CONF_INTERVAL,default=30): vol.All(int,vol.Range(min=1)),
+    vol.Optional(CONF_MIN_INTERVAL,default=5): vol.All(int,vol.Range(min=1)),
+    vol.Optional(CONF_MAX_INTERVAL,default=60): vol.All(int,vol.Range(min=1)),
+    vol.Optional(CONF_BATCH,default=False): bool,
+    vol.Optional(CONF_PUSH,default=False): bool,
+    vol.Optional(CONF_DEADBAND,default=0.0): vol.Coerce(float),
+    vol.Optional(CONF_SAMPLE,default=False): bool,
+    vol.Optional(CONF_SAMPLE_INTERVAL,default=0.5): vol.All(vol.Coerce(float),vol.Range(min=0.1)),
+    vol.Optional(CONF_STATISTICS,default=False): bool,})
 
 
 async def validate_input(hass: HomeAssistant, data: dict) -> dict[str, Any]:
@@ -38,15 +52,17 @@ async def validate_input(hass: HomeAssistant, data: dict) -> dict[str, Any]:
 
     Data has the keys from DATA_SCHEMA with values provided by the user.
     """
-
-    hub = Hub(hass, data)
-    result = await hub.test_connection()
-    if result==2:
+    if data[CONF_MIN_INTERVAL] > data[CONF_MAX_INTERVAL]:
+        raise InvalidInterval
+
+    try:
+        logged_in = await checkLogin(data[CONF_HOST], data[CONF_PORT], data[CONF_PASS])
+    except (EOFError, OSError, ConnectionError) as ex:
+        raise CannotConnect from ex
+    if not logged_in:
         raise InvalidAuth
-    elif result==3:
-        raise CannotConnect
 
-    return {CONF_HOST: data[CONF_HOST], CONF_PORT:data[CONF_PORT], CONF_PASS:data[CONF_PASS],CONF_ID:data[CONF_ID],CONF_INTERVAL:data[CONF_INTERVAL]}
+    return {CONF_HOST: data[CONF_HOST], CONF_PORT:data[CONF_PORT], CONF_PASS:data[CONF_PASS],CONF_ID:data[CONF_ID],CONF_INTERVAL:data[CONF_INTERVAL],CONF_MIN_INTERVAL:data[CONF_MIN_INTERVAL],CONF_MAX_INTERVAL:data[CONF_MAX_INTERVAL],CONF_BATCH:data[CONF_BATCH],CONF_PUSH:data[CONF_PUSH],CONF_DEADBAND:data[CONF_DEADBAND],CONF_SAMPLE:data[CONF_SAMPLE],CONF_SAMPLE_INTERVAL:data[CONF_SAMPLE_INTERVAL],CONF_STATISTICS:data[CONF_STATISTICS]}
 
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -55,8 +71,54 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 1
     CONNECTION_CLASS = config_entries.CONN_CLASS_LOCAL_PUSH
 
+    def __init__(self) -> None:
+        self._found: list[tuple[str, int]] = []
+        self._picked: dict[str, Any] = {}
+        self._reauth_entry: config_entries.ConfigEntry | None = None
+
     async def async_step_user(self, user_input=None):
-        """Handle the initial step."""
+        """Let the user choose between scanning the network and typing a host."""
+        return self.async_show_menu(step_id="user", menu_options=["discover", "manual"])
+
+    async def async_step_discover(self, user_input=None):
+        """Scan a subnet for powerstrips that are not configured yet."""
+        errors = {}
+        if user_input is not None:
+            try:
+                subnet = ipaddress.ip_network(user_input["network"], strict=False)
+            except ValueError:
+                errors["network"] = "invalid_network"
+            else:
+                if subnet.num_addresses > DISCOVERY_MAX_HOSTS:
+                    errors["network"] = "network_too_large"
+                else:
+                    configured = [(entry.data[CONF_HOST], entry.data[CONF_PORT]) for entry in self._async_current_entries()]
+                    self._found = await discover(str(subnet), (user_input[CONF_PORT],), DISCOVERY_CONCURRENCY,
+                                                 DISCOVERY_TIMEOUT, configured)
+                    if self._found:
+                        return await self.async_step_pick()
+                    errors["base"] = "no_devices_found"
+        try:
+            default = str(ipaddress.ip_network(f"{await network.async_get_source_ip(self.hass)}/24", strict=False))
+        except Exception:  # pylint: disable=broad-except
+            default = "192.168.1.0/24"
+        return self.async_show_form(
+            step_id="discover",
+            data_schema=vol.Schema({vol.Required("network", default=default): str, vol.Optional(CONF_PORT, default=23): int}),
+            errors=errors,
+        )
+
+    async def async_step_pick(self, user_input=None):
+        """Choose one of the discovered powerstrips, then fill in the rest."""
+        choices = {f"{host}:{port}": host if port == 23 else f"{host}:{port}" for host, port in self._found}
+        if user_input is not None:
+            host, _, port = user_input["device"].rpartition(":")
+            self._picked = {CONF_HOST: host, CONF_PORT: int(port)}
+            return await self.async_step_manual()
+        return self.async_show_form(step_id="pick", data_schema=vol.Schema({vol.Required("device"): vol.In(choices)}))
+
+    async def async_step_manual(self, user_input=None):
+        """Handle the connection settings, prefilled with a picked powerstrip."""
         errors = {}
         if user_input is not None:
             try:
@@ -66,12 +128,39 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 errors["base"] = "cannot_connect"
             except InvalidAuth:
                 errors["base"] = "invalid_auth"
+            except InvalidInterval:
+                errors["base"] = "invalid_interval"
             except Exception:  # pylint: disable=broad-except
                 _LOGGER.exception("Unexpected exception")
                 errors["base"] = "unknown"
 
         return self.async_show_form(
-            step_id="user", data_schema=DATA_SCHEMA, errors=errors
+            step_id="manual", data_schema=self.add_suggested_values_to_schema(DATA_SCHEMA, self._picked), errors=errors
+        )
+
+    async def async_step_reauth(self, entry_data):
+        """Ask for a new password after the powerstrip rejected the stored one."""
+        self._reauth_entry = self.hass.config_entries.async_get_entry(self.context["entry_id"])
+        return await self.async_step_reauth_confirm()
+
+    async def async_step_reauth_confirm(self, user_input=None):
+        """Check the new password, then store it and reload the entry."""
+        errors = {}
+        entry = self._reauth_entry
+        if user_input is not None:
+            try:
+                logged_in = await checkLogin(entry.data[CONF_HOST], entry.data[CONF_PORT], user_input[CONF_PASS])
+            except (EOFError, OSError, ConnectionError):
+                errors["base"] = "cannot_connect"
+            else:
+                if logged_in:
+                    return self.async_update_reload_and_abort(entry, data={**entry.data, CONF_PASS: user_input[CONF_PASS]})
+                errors["base"] = "invalid_auth"
+        return self.async_show_form(
+            step_id="reauth_confirm",
+            data_schema=vol.Schema({vol.Optional(CONF_PASS, default=""): str}),
+            description_placeholders={"host": entry.data[CONF_HOST]},
+            errors=errors,
         )
 
 class CannotConnect(exceptions.HomeAssistantError):
@@ -79,3 +168,6 @@ class CannotConnect(exceptions.HomeAssistantError):
 
 class InvalidAuth(exceptions.HomeAssistantError):
     """Error to indicate there is an invalid hostname."""
+
+class InvalidInterval(exceptions.HomeAssistantError):
+    """Error to indicate the minimum poll interval is above the maximum."""
@@ -1,8 +1,23 @@
 
 DOMAIN = "ptsp01_powerstrip"
+# hass.data key of the PollScheduler shared by all powerstrips
+DATA_SCHEDULER = DOMAIN+"_scheduler"
 
 CONF_HOST="host"
 CONF_PORT="port"
 CONF_PASS="password"
 CONF_ID="custom_id"
-CONF_INTERVAL="update_interval"
\ No newline at end of file
+CONF_INTERVAL="update_interval"
+CONF_BATCH="batch_query"
+CONF_PUSH="push_mode"
+CONF_DEADBAND="push_deadband"
+CONF_MIN_INTERVAL="min_interval"
+CONF_MAX_INTERVAL="max_interval"
+CONF_SAMPLE="sample_mode"
+CONF_SAMPLE_INTERVAL="sample_interval"
+CONF_STATISTICS="external_statistics"
+
+SERVICE_PROFILE="profile"
+SERVICE_SET_SWITCHES="set_switches"
+# Strips switched at once by set_switches
+SWITCH_CONCURRENCY=16
@@ -0,0 +1,28 @@
+"""Diagnostics support for the powerstrip."""
+from __future__ import annotations
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .hub import Hub
+from .const import CONF_PASS, DOMAIN
+
+TO_REDACT = {CONF_PASS}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    hub:Hub = hass.data[DOMAIN][entry.entry_id]
+    strip = hub.strip
+    return {
+        "entry": async_redact_data(dict(entry.data), TO_REDACT),
+        "firmware_version": strip.version,
+        "state": strip.state.value,
+        "timings": strip.timings,
+        "interval": strip.interval,
+        "metrics": strip.metrics.as_dict(),
+        "framer_overflows": strip.framer.overflows,
+        "sockets": {socket: {name: getattr(state, name) for name in state.__slots__} for socket, state in strip.states.items()},
+    }
@@ -0,0 +1,94 @@
+"""Hourly energy statistics of the outlets, imported in bulk as external statistics."""
+from __future__ import annotations
+import logging
+import re
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import async_add_external_statistics, get_last_statistics
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_change
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+
+if TYPE_CHECKING:
+    from .hub import Hub
+
+_LOGGER = logging.getLogger(__name__)
+# Statistic suffix -> name suffix, the tariffs come from the EnergyMeter record
+TARIFFS = {"energy": "Energy", "energy_peak": "Energy peak", "energy_valley": "Energy valley"}
+
+
+class EnergyStatistics:
+    """Collects the last counter reading of every hour and writes the completed hours in one call per statistic."""
+
+    def __init__(self, hass: HomeAssistant, hub: Hub) -> None:
+        self._hass = hass
+        self._hub = hub
+        self._hours: dict[str, dict[datetime, float]] = {}     # statistic_id -> hour start -> last reading in it
+        self._last: dict[str, tuple[float, float]] = {}         # statistic_id -> (state, sum) of the last hour written
+        self._unsub: Callable[[], None] | None = None
+
+    def statisticId(self, socket: int, tariff: str) -> str:
+        return f"{DOMAIN}:" + re.sub(r"[^a-z0-9_]", "_", f"{self._hub._id}_{socket}_{tariff}".lower())
+
+    @callback
+    def record(self, socket: int):
+        """Remember the outlet's current counters as the latest reading of this hour."""
+        state = self._hub.strip.states[socket]
+        hour = dt_util.utcnow().replace(minute=0, second=0, microsecond=0)
+        readings = {"energy": state.counter_energy}     # published readings lag behind until the poll completes
+        if state.tariffs is not None:
+            readings["energy_peak"], readings["energy_valley"] = state.tariffs
+        for tariff, value in readings.items():
+            if value is not None:
+                self._hours.setdefault(self.statisticId(socket, tariff), {})[hour] = value
+
+    async def async_start(self):
+        """Continue the sums from the recorder and export every hour."""
+        for outlet in self._hub.outlets:
+            for tariff in TARIFFS:
+                statistic_id = self.statisticId(outlet._socket, tariff)
+                last = await get_instance(self._hass).async_add_executor_job(
+                    get_last_statistics, self._hass, 1, statistic_id, True, {"state", "sum"})
+                if last.get(statistic_id):
+                    row = last[statistic_id][0]
+                    self._last[statistic_id] = (row["state"] or 0, row["sum"] or 0)
+        self._unsub = async_track_time_change(self._hass, self.async_export, minute=0, second=30)
+
+    async def async_stop(self):
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+
+    @callback
+    def async_export(self, now: datetime | None = None):
+        """Write the hours that are over, a counter that went down counts as a reset to zero."""
+        current = dt_util.utcnow().replace(minute=0, second=0, microsecond=0)
+        for outlet in self._hub.outlets:
+            for tariff, name in TARIFFS.items():
+                statistic_id = self.statisticId(outlet._socket, tariff)
+                hours = self._hours.get(statistic_id, {})
+                done = sorted(hour for hour in hours if hour < current)
+                if not done:
+                    continue
+                state, total = self._last.get(statistic_id, (hours[done[0]], 0.0))
+                statistics = []
+                for hour in done:
+                    value = hours.pop(hour)
+                    total += value - state if value >= state else value
+                    state = value
+                    statistics.append(StatisticData(start=hour, state=state, sum=total))
+                self._last[statistic_id] = (state, total)
+                metadata = StatisticMetaData(
+                    has_mean=False,
+                    has_sum=True,
+                    name=f"{outlet.name} {name}",
+                    source=DOMAIN,
+                    statistic_id=statistic_id,
+                    unit_of_measurement="Wh",
+                )
+                async_add_external_statistics(self._hass, metadata, statistics)
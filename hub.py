@@ -4,16 +4,27 @@ import logging
 import asyncio
 import time
 import traceback
+from datetime import timedelta
 from typing import Any, Callable
 
-from homeassistant.core import HomeAssistant
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import Event, HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.config_entries import ConfigEntry,ConfigEntryNotReady,ConfigEntryAuthFailed
 from homeassistant.components.switch import SwitchEntity
 from homeassistant.components.sensor import SensorEntity
-from .ptsp01telnet import ptsp01
-from .const import CONF_INTERVAL, CONF_PASS,CONF_HOST,CONF_ID,CONF_PORT
+from .energy_statistics import EnergyStatistics
+from .ptsp01telnet import ConnectionState, PollScheduler, ptsp01
+from .const import DOMAIN, DATA_SCHEDULER, CONF_BATCH, CONF_DEADBAND, CONF_INTERVAL, CONF_MAX_INTERVAL, CONF_MIN_INTERVAL, CONF_PUSH, CONF_SAMPLE, CONF_SAMPLE_INTERVAL, CONF_STATISTICS, CONF_PASS,CONF_HOST,CONF_ID,CONF_PORT
 
 _LOGGER = logging.getLogger(__name__)
+SNAPSHOT_VERSION = 1
+SNAPSHOT_INTERVAL = timedelta(minutes=5)
+# Older snapshots are not restored, the readings would be misleading
+SNAPSHOT_MAX_AGE = timedelta(days=1)
 
 class Hub:
     """Treats the powerstrip as a hub."""
@@ -26,59 +37,163 @@ class Hub:
         self._port = data[CONF_PORT]
         self._password = data[CONF_PASS]
         self._interval = data[CONF_INTERVAL] if CONF_INTERVAL in data.keys() else 30
+        self._batch = data[CONF_BATCH] if CONF_BATCH in data.keys() else False
+        self._push = data[CONF_PUSH] if CONF_PUSH in data.keys() else False
+        self._deadband = data[CONF_DEADBAND] if CONF_DEADBAND in data.keys() else 0
+        self._min_interval = data[CONF_MIN_INTERVAL] if CONF_MIN_INTERVAL in data.keys() else None
+        self._max_interval = data[CONF_MAX_INTERVAL] if CONF_MAX_INTERVAL in data.keys() else None
+        self._sample = data[CONF_SAMPLE] if CONF_SAMPLE in data.keys() else False
+        self._sample_interval = data[CONF_SAMPLE_INTERVAL] if CONF_SAMPLE_INTERVAL in data.keys() else 0.5
+        self._statistics = data[CONF_STATISTICS] if CONF_STATISTICS in data.keys() else False
         self._hass = hass
         self._id = data[CONF_ID] if CONF_ID in data.keys() and len(data[CONF_ID])>0 else "ptsp01_"+self._host.lower()
         self._name = self._id
         self.strip=ptsp01_push(self._host,self._port,self._password)
         self.strip.update_interval=self._interval
+        self.strip.batch_query=self._batch
+        self.strip.push_mode=self._push
+        self.strip.push_deadband=self._deadband
+        self.strip.min_interval=self._min_interval
+        self.strip.max_interval=self._max_interval
+        self.strip.sample_mode=self._sample
+        self.strip.sample_interval=self._sample_interval
+        self.strip.scheduler=hass.data.setdefault(DATA_SCHEDULER,PollScheduler())
         self.outlets=[
             OutletDevice(1,self._id+"_1",self),
             OutletDevice(2,self._id+"_2",self),
             OutletDevice(3,self._id+"_3",self)
         ]
         self.strip.outlets=self.outlets
-        self.strip.start_polling()
+        self.statistics=EnergyStatistics(hass,self) if self._statistics else None
+        self.strip.statistics=self.statistics
+        self._store=Store(hass,SNAPSHOT_VERSION,f"{DOMAIN}.{self._id}.snapshot")
+        self._unsub_snapshot:list[Callable[[], None]]=[]
     @property
     def firmware_version(self):
         return self.strip.version
     async def setup(self):
-        self.strip.connect()
-        self.strip.waitForLogin()
+        await self.strip.connect()
+        if await self.strip.waitForLogin():
+            self.strip.start_polling()
+    async def startStatistics(self):
+        """Export energy statistics, whether or not the strip is connected yet."""
+        if self.statistics is not None:
+            await self.statistics.async_start()
+    async def setupInBackground(self, entry:ConfigEntry):
+        """Connect while the entities already show the restored readings."""
+        try:
+            await self.setup()
+        except ConfigEntryAuthFailed:
+            # As on a cold start, where async_setup_entry raises ConfigEntryAuthFailed
+            _LOGGER.error("Invalid password for %s", self._host)
+            self.strip.stale.clear()
+            entry.async_start_reauth(self._hass)
+        except (EOFError,OSError,ConnectionError) as ex:
+            _LOGGER.warning("Failed connecting to %s, retrying in the background: %s", self._host, ex)
+            self.strip.stale.clear()
+            self.strip.start_polling()
+            self.strip.startReconnect()
+        self.strip.updateAll()
+    async def restore(self) -> bool:
+        """Load the readings saved before the restart as stale ones, return whether there were recent ones."""
+        data=await self._store.async_load()
+        if not data or dt_util.utcnow()-dt_util.parse_datetime(data["saved"])>SNAPSHOT_MAX_AGE:
+            return False
+        self.strip.restore(data["strip"])
+        return bool(self.strip.stale)
+    def startSnapshots(self):
+        """Save the readings every SNAPSHOT_INTERVAL and when Home Assistant stops."""
+        self._unsub_snapshot=[
+            async_track_time_interval(self._hass, self._async_schedule_save, SNAPSHOT_INTERVAL),
+            self._hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_save),
+        ]
+    def _snapshot(self) -> dict:
+        return {"saved":dt_util.utcnow().isoformat(),"strip":self.strip.snapshot()}
+    @callback
+    def _async_schedule_save(self, now=None):
+        if self.strip.metrics.last_reading is not None:     # nothing live to save yet, keep the old snapshot's age
+            self._store.async_delay_save(self._snapshot, 0)
+    async def _async_save(self, event:Event|None=None):
+        if self.strip.metrics.last_reading is not None:
+            await self._store.async_save(self._snapshot())
+    async def close(self):
+        for unsub in self._unsub_snapshot:
+            unsub()
+        self._unsub_snapshot=[]
+        await self._async_save()
+        if self.statistics is not None:
+            await self.statistics.async_stop()
+        await self.strip.close()
     @property
     def online(self):
-        return self.strip.isLoggedin()==True
+        """Logged in, or showing readings restored at startup until the first poll."""
+        return self.strip.isLoggedin()==True or bool(self.strip.stale)
     @property
     def hub_id(self) -> str:
         """ID for hub."""
         return self._id
-
-    async def test_connection(self) -> int:
-        """Test connectivity to the hub is OK."""
-        try:
-            self.strip.connect()
-            return 1 if self.strip.waitForLogin() else 3
-        except ConnectionError:
-            return 2
+# Status key -> OutletDevice attribute holding the entity showing it
+STATUS_ENTITIES={
+    "Switch":("switch",),
+    "Voltage":("voltage_sensor",),
+    "Current":("current_sensor",),
+    "Power":("power_sensor","integrated_energy_sensor"),
+    "Energy":("energy_sensor","integrated_energy_sensor"),
+    "EnergyMeter.SingleCount":("energy_sensor","integrated_energy_sensor"),
+}
 class ptsp01_push(ptsp01):
     outlets:list[OutletDevice]
+    statistics:EnergyStatistics|None=None
+    def __init__(self, host: str, port: int = 23, password: str = ""):
+        super().__init__(host, port, password)
+        self._dirty:set=set()
+        self._flush_scheduled=False
+    @property
+    def trace(self):
+        return _LOGGER.isEnabledFor(logging.DEBUG)
     def onMessage(self, message: str):
         _LOGGER.debug(f"From PTSP01:%s",message)
         return super().onMessage(message)
+    def onTrace(self,spans:dict[str,float]):
+        _LOGGER.debug("%s: %d lines, frame %.3fms, parse %.3fms, update %.3fms",self.host,spans["lines"],
+                      spans["frame"]*1000,spans["parse"]*1000,spans["update"]*1000)
+    def updateEntity(self,entity):
+        """Write entity state if it changed, skipping entities not added to HA yet."""
+        if entity is not None and entity.hass is not None and entity.changed():
+            entity.async_write_ha_state()
     def onStatusUpdate(self,socket:int,key:str):
-        outlet=self.outlets[socket-1]
-        if key==("Switch"):
-            outlet.switch.schedule_update_ha_state()
-        elif key==("Voltage"):
-            outlet.voltage_sensor.schedule_update_ha_state()
-        elif key==("Current"):
-            outlet.current_sensor.schedule_update_ha_state()
-        elif key==("Power"):
-            outlet.power_sensor.schedule_update_ha_state()
-        elif key==("EnergyMeter.SingleCount"):
-            outlet.energy_sensor.schedule_update_ha_state()
-    def switch(self, socket: int, switch: int):
-        super().switch(socket, switch)
-        self.getSwitch(socket)
+        if socket>len(self.outlets):
+            return
+        if self.statistics is not None and key in ("Energy","EnergyMeter.SingleCount"):
+            self.statistics.record(socket)
+        if key=="Samples":
+            self._dirty.update(self.outlets[socket-1].sample_sensors)
+        elif key in STATUS_ENTITIES:
+            for name in STATUS_ENTITIES[key]:
+                entity=getattr(self.outlets[socket-1],name)
+                if entity is not None:
+                    self._dirty.add(entity)
+        else:
+            return
+        if not self.in_poll:    # readings of a poll are written together when it completes
+            self.scheduleFlush()
+    def onPollComplete(self):
+        self.scheduleFlush()
+    def onSwitched(self,sockets:set[int]):
+        self.scheduleFlush()
+    def scheduleFlush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled=True
+            asyncio.get_running_loop().call_soon(self.flush)
+    def flush(self):
+        """Write every entity that got new readings, in one event loop callback."""
+        self._flush_scheduled=False
+        dirty,self._dirty=self._dirty,set()
+        started=time.perf_counter()
+        for entity in dirty:
+            self.updateEntity(entity)
+        if dirty and self.trace:
+            _LOGGER.debug("%s: flushed %d entities in %.3fms",self.host,len(dirty),(time.perf_counter()-started)*1000)
     def onException(self,exception:Exception):
         _LOGGER.error("Exception:%s",traceback.format_exc())
     def onLoginFailure(self):
@@ -87,36 +202,34 @@ class ptsp01_push(ptsp01):
     def onConnectionFailure(self,e):
         _LOGGER.warning("Connection Error:%s",traceback.format_exc())
         super().onConnectionFailure(e)
+        self.updateAll()
+        self.startReconnect()
+    def updateAll(self):
+        """Write every entity, for availability changes."""
         for outlet in self.outlets:
-            outlet.switch.schedule_update_ha_state()
-            outlet.voltage_sensor.schedule_update_ha_state()
-            outlet.current_sensor.schedule_update_ha_state()
-            outlet.power_sensor.schedule_update_ha_state()
-            outlet.energy_sensor.schedule_update_ha_state()
-        self.tryReconnect()
-    def tryReconnect(self):
-        connected=False
-        while(not connected):
-            try:
-                self.closeConnection()
-                self.connect()
-                connected=self.waitForLogin()
-                if not connected:
-                    _LOGGER.warning("Reconnect Failed, retrying in %s seconds", 20)
-                    time.sleep(20)
-            except:
-                _LOGGER.warning("Reconnect Failed:%s, retrying in %s seconds",traceback.format_exc(), 20)
-                time.sleep(20)
-        # raise ConnectionError
+            for names in STATUS_ENTITIES.values():
+                for name in names:
+                    self.updateEntity(getattr(outlet,name))
+            for entity in outlet.sample_sensors:
+                self.updateEntity(entity)
+    def onFirstData(self):
+        _LOGGER.info("%s: connected in %.2fs, logged in after %.2fs, first reading after %.2fs",
+                     self.host,self.timings.get("connect",0),self.timings.get("login",0),self.timings["first_data"])
+    def onReconnectFailure(self,exception:Exception,attempt:int):
+        _LOGGER.warning("Reconnect attempt %s to %s failed: %s",attempt,self.host,exception)
+    def onStateChange(self,old:ConnectionState,new:ConnectionState):
+        _LOGGER.debug("%s: %s -> %s",self.host,old.value,new.value)
     def logMessage(self, *values):
         _LOGGER.warning("%s",values.__str__())
 class OutletDevice:
     _state=None
-    switch: SwitchEntity
-    voltage_sensor:SensorEntity
-    current_sensor:SensorEntity
-    power_sensor:SensorEntity
-    energy_sensor:SensorEntity
+    switch: SwitchEntity|None=None
+    voltage_sensor:SensorEntity|None=None
+    current_sensor:SensorEntity|None=None
+    power_sensor:SensorEntity|None=None
+    energy_sensor:SensorEntity|None=None
+    integrated_energy_sensor:SensorEntity|None=None
+    sample_sensors:list[SensorEntity]
     def __init__(self, socket:int,name:str,hub:Hub):
         self._socket=socket
         self._id=hub._id+"_"+str(socket)
@@ -124,6 +237,7 @@ class OutletDevice:
         self._strip=hub.strip
         self.name=name
         self._callbacks = set()
+        self.sample_sensors=[]
         self._loop = asyncio.get_event_loop()
         self.model = "PTSP01"
     @property
@@ -132,15 +246,24 @@ class OutletDevice:
     @property
     def is_on(self) -> bool | None:
         """Return true if the outlet is on."""
-        return self._strip.states[self._socket].switch
+        return self._strip.published[self._socket].switch
 
-    def turn_on(self, **kwargs: Any) -> None:
-        self._strip.switch(self._socket,1)
-        self._state=True
+    async def turn_on(self, **kwargs: Any) -> None:
+        await self.setSwitch(1)
 
-    def turn_off(self, **kwargs: Any) -> None:
-        self._strip.switch(self._socket,0)
-        self._state=False
+    async def turn_off(self, **kwargs: Any) -> None:
+        await self.setSwitch(0)
+
+    async def setSwitch(self, switch:int) -> None:
+        """Switch the outlet and wait for the powerstrip to confirm it."""
+        try:
+            confirmed=await self._strip.setSwitch(self._socket,switch)
+        except (TimeoutError,ConnectionError) as ex:
+            raise HomeAssistantError(f"No response from {self.name}") from ex
+        _LOGGER.debug("Switched %s to %s in %.3fs",self.name,switch,self._strip.switch_latency)
+        if not confirmed:
+            raise HomeAssistantError(f"{self.name} did not switch")
+        self._state=switch==1
 
 
     def register_callback(self, callback: Callable[[], None]) -> None:
@@ -162,4 +285,17 @@ class OutletDevice:
     @property
     def energy(self) -> float:
         return self._strip.getEnergy(self._socket)
+    @property
+    def stale(self) -> bool:
+        """Readings are the ones restored at startup."""
+        return self._socket in self._strip.stale
+    @property
+    def integrated_energy(self) -> float:
+        return self._strip.getIntegratedEnergy(self._socket)
+    def aggregates(self, item:str) -> dict[str,float]:
+        """Rolling mean/std (and energy for Power) of the item over the last 5 minutes and hour, peak/min over 5 minutes."""
+        return self._strip.getAggregates(self._socket,item)
+    def sample(self, item:str, stat:str) -> float|None:
+        """min/max/mean/p50/p95 of the item's samples fetched in the last poll."""
+        return self._strip.samples.get(self._socket,{}).get(item,{}).get(stat)
 
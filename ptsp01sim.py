@@ -0,0 +1,443 @@
+"""Simulated PTSP01 powerstrip speaking the device's telnet protocol.
+
+Used to exercise ptsp01/ptsp01_push, the reconnect path and benchmarks
+without real hardware. Runs standalone:
+
+    python ptsp01sim.py --count 50 --port 2300 --latency 0.05 --jitter 0.02
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import re
+import time
+
+PROMPT="root@(none):/# "
+LOGIN_PROMPT="(none) login: "
+BANNER=(
+    "\r\n\r\nBusyBox v1.19.4 (2015-06-17 10:30:54 CST) built-in shell (ash)\r\n"
+    "Enter 'help' for a list of built-in commands.\r\n\r\n"
+    "  _______                     ________        __\r\n"
+    " |       |.-----.-----.-----.|  |  |  |.----.|  |_\r\n"
+    " |   -   ||  _  |  -__|     ||  |  |  ||   _||   _|\r\n"
+    " |_______||   __|_____|__|__||________||__|  |____|\r\n"
+    "          |__| W I R E L E S S   F R E E D O M\r\n"
+    " -----------------------------------------------------\r\n"
+    " ATTITUDE ADJUSTMENT ({version})\r\n"
+    " -----------------------------------------------------\r\n"
+)
+MIB_PREFIX="Device.SmartPlug.Socket."
+MIB_ITEMS=["Switch","Voltage","Current","Power","Energy","EnergyMeter.SingleCount"]
+
+class SimulatedSocket:
+    """One outlet. Energy is integrated from the simulated load."""
+    def __init__(self,load:float=60.0,switch:bool=True) -> None:
+        self.switch=switch
+        self.load=load
+        self.voltage=220.0
+        self.power=0.0
+        self.peak_energy=0.0
+        self.valley_energy=0.0
+        self.__last=time.monotonic()
+    def sample(self):
+        now=time.monotonic()
+        dt=now-self.__last
+        self.__last=now
+        self.voltage=round(220.0+random.uniform(-3,3),1)
+        self.power=round(self.load*random.uniform(0.95,1.05),1) if self.switch and self.load>0 else 0.0
+        self.peak_energy+=self.power*dt/3600
+    @property
+    def current(self):
+        return round(self.power/self.voltage,3) if self.voltage else 0.0
+    @property
+    def energy(self):
+        return self.peak_energy+self.valley_energy
+
+class SimulatedStrip:
+    """Device state shared by every telnet session of one strip."""
+    def __init__(self,sockets:int=3,password:str="",version:str="12.09, r36088",load:float=60.0) -> None:
+        self.password=password
+        self.version=version
+        self.sockets={i:SimulatedSocket(load) for i in range(1,sockets+1)}
+        self.files:dict[str,str]={}
+        self.push_task:asyncio.Task|None=None
+        self.sample_task:asyncio.Task|None=None
+    def get(self,path:str)->str|None:
+        """Return the qmibtree -g output line for path, or None if unknown."""
+        if not path.startswith(MIB_PREFIX):
+            return None
+        index,_,item=path[len(MIB_PREFIX):].partition(".")
+        if not index.isdigit() or int(index) not in self.sockets:
+            return None
+        socket=self.sockets[int(index)]
+        socket.sample()
+        if item=="Switch":
+            return f"{path}(bool) = {int(socket.switch)}"
+        elif item=="Voltage":
+            return f"{path}(string) = {socket.voltage}"
+        elif item=="Current":
+            return f"{path}(string) = {socket.current}"
+        elif item=="Power":
+            return f"{path}(string) = {socket.power}"
+        elif item=="Energy":
+            return f"{path}(string) = {round(socket.energy,2)}"
+        elif item=="EnergyMeter.SingleCount":
+            return f"{path}(string) = {{'peakenergy': '{round(socket.peak_energy,2)}', 'valleyenergy': '{round(socket.valley_energy,2)}'}}"
+        return None
+    def getTree(self,prefix:str)->list[str]:
+        """qmibtree -g on an object path ending in "." lists every leaf below it."""
+        return [self.get(f"{MIB_PREFIX}{index}.{item}") for index in self.sockets for item in MIB_ITEMS
+                if f"{MIB_PREFIX}{index}.{item}".startswith(prefix)]
+    def set(self,path:str,value:str)->bool:
+        if not path.startswith(MIB_PREFIX) or not path.endswith(".Switch"):
+            return False
+        index=path[len(MIB_PREFIX):].partition(".")[0]
+        if not index.isdigit() or int(index) not in self.sockets:
+            return False
+        socket=self.sockets[int(index)]
+        socket.sample()
+        socket.switch=value=="1"
+        return True
+
+class SimulatorSession:
+    """A logged in (or logging in) shell on one telnet connection."""
+    def __init__(self,server:"SimulatorServer",reader:asyncio.StreamReader,writer:asyncio.StreamWriter) -> None:
+        self.server=server
+        self.strip=server.strip
+        self.reader=reader
+        self.writer=writer
+        self.heredoc:list|None=None   # [file, terminator, lines, quiet, rest of the command line]
+        self.background:set[asyncio.Task]=set()
+        self.status=0       # $?
+    def write(self,text:str):
+        self.writer.write(text.encode())
+    async def readLine(self)->str|None:
+        data=await self.reader.readline()
+        if not data:
+            return None
+        return data.decode(errors="replace").rstrip("\r\n")
+    async def login(self)->bool:
+        if not self.strip.password:
+            return True
+        while True:
+            self.write(LOGIN_PROMPT)
+            user=await self.readLine()
+            if user is None:
+                return False
+            self.write(user+"\r\nPassword: ")
+            password=await self.readLine()
+            if password is None:
+                return False
+            self.write("\r\n")
+            if user=="root" and password==self.strip.password:
+                return True
+            await asyncio.sleep(self.server.latency)
+            self.write("Login incorrect\r\n")
+    async def run(self):
+        try:
+            await self.shell()
+        finally:
+            for task in self.background:
+                task.cancel()
+    async def shell(self):
+        if not await self.login():
+            return
+        self.write(BANNER.format(version=self.strip.version)+PROMPT)
+        while True:
+            line=await self.readLine()
+            if line is None:
+                return
+            await self.server.running.wait()
+            self.write(line+"\r\n")     # terminal echo
+            if self.heredoc is not None:
+                await self.feedHeredoc(line)
+                continue
+            if self.server.drop_rate and random.random()<self.server.drop_rate:
+                self.writer.transport.abort()
+                return
+            await self.server.delay()
+            output="".join(text+"\r\n" for text in await self.execute(line))
+            self.write(output+("> " if self.heredoc is not None else PROMPT))
+            await self.writer.drain()
+    async def feedHeredoc(self,line:str):
+        file,terminator,lines,quiet,rest=self.heredoc
+        if line==terminator:
+            self.heredoc=None
+            content="".join(text+"\n" for text in lines)
+            self.strip.files[file]=content
+            output=[] if quiet else lines    # tee copies to stdout
+            output=output+await self.execute(rest)
+            self.write("".join(text+"\r\n" for text in output)+PROMPT)
+        else:
+            lines.append(line)
+            self.write("> ")
+    async def execute(self,line:str)->list[str]:
+        if ";" in line:
+            output=[]
+            parts=line.split(";")
+            for index,part in enumerate(parts):
+                output.extend(await self.execute(part))
+                if self.heredoc is not None:    # the rest runs once the here-document is read
+                    self.heredoc[4]=";".join(parts[index+1:])
+                    break
+            return output
+        args=[arg.replace("$?",str(self.status)) for arg in line.split()]
+        if not args:
+            return []
+        command=self.server.commands.get(args[0])
+        if command is None:
+            self.status=127
+            return [f"-ash: {args[0]}: not found"]
+        self.status=0
+        if args[-1]=="&":
+            task=asyncio.create_task(command(self,args[:-1]))
+            self.background.add(task)
+            task.add_done_callback(self.background.discard)
+            return []
+        return await command(self,args)
+    async def cmdTee(self,args:list[str])->list[str]:
+        terminator=next((arg for arg in args if arg.startswith("<<")),None)
+        if len(args)>=3 and terminator is not None:
+            self.heredoc=[args[1],terminator[2:].strip("'\""),[],">/dev/null" in args,""]
+        return []
+    async def cmdEcho(self,args:list[str])->list[str]:
+        return [" ".join(args[1:])]
+    async def cmdMd5sum(self,args:list[str])->list[str]:
+        output=[]
+        for path in args[1:]:
+            if ">" in path:
+                continue
+            if path in self.strip.files:
+                output.append(f"{hashlib.md5(self.strip.files[path].encode()).hexdigest()}  {path}")
+            else:
+                self.status=1
+                if "2>/dev/null" not in args:
+                    output.append(f"md5sum: {path}: No such file or directory")
+        return output
+    async def cmdCat(self,args:list[str])->list[str]:
+        output=[]
+        for path in args[1:]:
+            if ">" in path:
+                continue
+            if path in self.strip.files:
+                output.extend(self.strip.files[path].splitlines())
+            else:
+                self.status=1
+                if "2>/dev/null" not in args:
+                    output.append(f"cat: can't open '{path}': No such file or directory")
+        return output
+    async def cmdAwk(self,args:list[str])->list[str]:
+        """Only field comparisons: awk -F<sep> -v <name>=<number> '$<field>><name>' files..."""
+        separator=" "
+        variables={}
+        program=None
+        files=[]
+        index=1
+        while index<len(args):
+            arg=args[index].strip("'\"")
+            if arg.startswith("-F"):
+                separator=arg[2:].strip("'\"")
+            elif arg=="-v" and index+1<len(args):
+                index+=1
+                name,_,value=args[index].partition("=")
+                variables[name]=float(value)
+            elif program is None:
+                program=re.fullmatch(r"\$(\d+)>(\w+)",arg)
+                if program is None:
+                    self.status=2
+                    return [f"awk: unsupported program {arg}"]
+            elif ">" not in arg:
+                files.append(arg)
+            index+=1
+        output=[]
+        for path in files:
+            if path not in self.strip.files:
+                self.status=2
+                continue
+            for line in self.strip.files[path].splitlines():
+                fields=line.split(separator)
+                field=int(program[1])
+                if len(fields)>=field and fields[field-1].isdigit() and int(fields[field-1])>variables.get(program[2],0):
+                    output.append(line)
+        return output
+    async def cmdSh(self,args:list[str])->list[str]:
+        if len(args)<2 or args[1] not in self.strip.files:
+            return [f"sh: can't open '{args[1] if len(args)>1 else ''}'"]
+        lines=self.strip.files[args[1]].splitlines()
+        script=self.server.scripts.get(lines[1] if len(lines)>1 else "")
+        if script is not None:     # helper scripts need a real shell, emulate them instead
+            return await script(self,args)
+        output=[]
+        for line in lines:
+            output.extend(await self.execute(line))
+        return output
+    async def cmdQmibtree(self,args:list[str])->list[str]:
+        if self.server.exec_delay:
+            await asyncio.sleep(self.server.exec_delay)
+        if len(args)>=3 and args[1]=="-g" and args[2].endswith("."):
+            return self.strip.getTree(args[2])
+        elif len(args)>=3 and args[1]=="-g":
+            result=self.strip.get(args[2])
+            if result is not None:
+                return [result]
+            self.status=1
+            return [f"qmibtree: get {args[2]} failed"]
+        elif len(args)>=4 and args[1]=="-s":
+            if self.strip.set(args[2],args[3]):
+                return []
+            self.status=1
+            return [f"qmibtree: set {args[2]} failed"]
+        self.status=1
+        return ["Usage: qmibtree -g <path> | -s <path> <value>"]
+    async def scriptBatchStatus(self,args:list[str])->list[str]:
+        record="PTSP01"
+        for line in await self.cmdQmibtree(["qmibtree","-g",MIB_PREFIX]):
+            path,_,value=line.partition("=")
+            record=record+"|"+path.split("(")[0][len(MIB_PREFIX):]+"="+value
+        return [record]
+    async def scriptPushStates(self,args:list[str])->list[str]:
+        if self.strip.push_task is not None:    # the script kills the instance from its pid file
+            self.strip.push_task.cancel()
+        self.strip.push_task=asyncio.current_task()
+        interval=float(args[2]) if len(args)>2 else 10
+        deadband=float(args[3]) if len(args)>3 else 0
+        last:dict[str,str]={}
+        while True:
+            for line in await self.cmdQmibtree(["qmibtree","-g",MIB_PREFIX]):
+                path,_,value=line.partition("=")
+                key=path.split("(")[0].strip()
+                value=value.strip()
+                if key in last and key.rsplit(".",1)[-1] in ("Voltage","Current","Power","Energy"):
+                    if abs(float(value)-float(last[key]))<=abs(deadband/100*float(last[key])):
+                        continue
+                if last.get(key)!=value:
+                    last[key]=value
+                    self.write(line+"\r\n")
+            await asyncio.sleep(interval)
+    async def scriptSampleStates(self,args:list[str])->list[str]:
+        if self.strip.sample_task is not None:
+            self.strip.sample_task.cancel()
+        self.strip.sample_task=asyncio.current_task()
+        interval=float(args[2]) if len(args)>2 else 0.5
+        size=int(args[3]) if len(args)>3 else 600
+        files=self.strip.files
+        files.pop("/tmp/samples.0",None)
+        files.pop("/tmp/samples.1",None)
+        seq=0
+        while True:
+            seq+=1
+            record=f"PTSPS|{seq}"
+            for line in await self.cmdQmibtree(["qmibtree","-g",MIB_PREFIX]):
+                path,_,value=line.partition("=")
+                key=path.split("(")[0].strip()[len(MIB_PREFIX):]
+                if key.endswith(".Current") or key.endswith(".Power"):
+                    record=record+f"|{key}={value.strip()}"
+            files["/tmp/samples.0"]=files.get("/tmp/samples.0","")+record+"\n"
+            if seq%size==0:
+                files["/tmp/samples.1"]=files.pop("/tmp/samples.0")
+            await asyncio.sleep(interval)
+
+class SimulatorServer:
+    """Telnet server for one simulated strip.
+
+    latency/jitter delay each command's response, exec_delay is charged per
+    qmibtree process, drop_rate is the chance a command kills the connection.
+    """
+    commands={
+        "echo":SimulatorSession.cmdEcho,
+        "tee":SimulatorSession.cmdTee,
+        "md5sum":SimulatorSession.cmdMd5sum,
+        "cat":SimulatorSession.cmdCat,
+        "awk":SimulatorSession.cmdAwk,
+        "sh":SimulatorSession.cmdSh,
+        "qmibtree":SimulatorSession.cmdQmibtree,
+    }
+    scripts={      # second line of a helper script -> emulation
+        "# ptsp01 batch status v1":SimulatorSession.scriptBatchStatus,
+        "# ptsp01 push states v1":SimulatorSession.scriptPushStates,
+        "# ptsp01 sampler v1":SimulatorSession.scriptSampleStates,
+    }
+    def __init__(self,strip:SimulatedStrip|None=None,host:str="127.0.0.1",port:int=0,
+                 latency:float=0.0,jitter:float=0.0,exec_delay:float=0.0,drop_rate:float=0.0) -> None:
+        self.strip=strip if strip is not None else SimulatedStrip()
+        self.host=host
+        self.port=port
+        self.latency=latency
+        self.jitter=jitter
+        self.exec_delay=exec_delay
+        self.drop_rate=drop_rate
+        self.server:asyncio.Server|None=None
+        self.sessions:dict[asyncio.StreamWriter,asyncio.Task]={}
+        self.connections=0
+        self.running=asyncio.Event()      # cleared by freeze(): sessions stay open but stop answering
+        self.running.set()
+    async def delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency+random.uniform(0,self.jitter))
+    async def start(self):
+        self.server=await asyncio.start_server(self.handle,self.host,self.port)
+        self.port=self.server.sockets[0].getsockname()[1]
+    async def stop(self):
+        tasks=list(self.sessions.values())
+        self.dropConnections()
+        await asyncio.gather(*tasks,return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server=None
+    def dropConnections(self):
+        for writer in list(self.sessions):
+            writer.transport.abort()
+    def freeze(self):
+        """Hang like a crashed device behind a live TCP stack, e.g. to test half-open detection."""
+        self.running.clear()
+    def thaw(self):
+        self.running.set()
+    async def powerCycle(self,downtime:float):
+        """Drop every session and refuse connections for downtime seconds."""
+        await self.stop()
+        await asyncio.sleep(downtime)
+        await self.start()
+    async def handle(self,reader:asyncio.StreamReader,writer:asyncio.StreamWriter):
+        self.connections+=1
+        self.sessions[writer]=asyncio.current_task()
+        try:
+            await self.delay()
+            await SimulatorSession(self,reader,writer).run()
+        except (ConnectionError,OSError):
+            pass
+        finally:
+            self.sessions.pop(writer,None)
+            writer.close()
+
+async def startFleet(count:int,host:str="127.0.0.1",port:int=0,**kwargs)->list[SimulatorServer]:
+    """Start count simulators on consecutive ports (or random ports when port is 0)."""
+    servers=[]
+    for i in range(count):
+        server=SimulatorServer(host=host,port=port+i if port else 0,**kwargs)
+        await server.start()
+        servers.append(server)
+    return servers
+
+async def main(args):
+    servers=await startFleet(args.count,args.host,args.port,latency=args.latency,jitter=args.jitter,
+                             exec_delay=args.exec_delay,drop_rate=args.drop_rate)
+    for server in servers:
+        server.strip.password=args.password
+        print(f"PTSP01 simulator listening on {server.host}:{server.port}")
+    await asyncio.Event().wait()
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Simulated PTSP01 powerstrips")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=2323,help="first port, 0 for random ports")
+    parser.add_argument("--count",type=int,default=1,help="number of strips")
+    parser.add_argument("--password",default="")
+    parser.add_argument("--latency",type=float,default=0.0,help="seconds added to every response")
+    parser.add_argument("--jitter",type=float,default=0.0,help="random extra seconds per response")
+    parser.add_argument("--exec-delay",type=float,default=0.0,help="seconds per qmibtree process")
+    parser.add_argument("--drop-rate",type=float,default=0.0,help="chance per command to drop the connection")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -1,134 +1,952 @@
-import json
-import telnetlib
+import array
+import asyncio
+import bisect
+import codecs
+import hashlib
+import heapq
+import ipaddress
+import itertools
+import math
+import random
+import re
+import socket
+import struct
 import time
-import threading
+from enum import Enum
+from typing import Any, Callable, Iterable, Iterator, Mapping, NamedTuple
+
+PROMPT="root@(none):/# "
+LOGIN_PROMPT="(none) login: "
+LOGIN_INCORRECT="Login incorrect"
+PROMPT_BYTES=PROMPT.encode()
+BATCH_PREFIX="PTSP01|"
+# Reads the whole socket subtree with a single qmibtree process and folds it
+# into one "PTSP01|1.Switch=1|1.Voltage=220.1|..." line using ash builtins only.
+BATCH_SCRIPT="""#!/bin/sh
+# ptsp01 batch status v1
+qmibtree -g Device.SmartPlug.Socket. | {
+r=PTSP01
+while read -r l; do
+k=${l%%=*}
+k=${k%%(*}
+k=${k%% *}
+case ${k#Device.SmartPlug.Socket.} in
+*.Switch|*.Voltage|*.Current|*.Power|*.Energy|*.EnergyMeter.SingleCount) r="$r|${k#Device.SmartPlug.Socket.}=${l#*=}";;
+esac
+done
+echo "$r"
+}
+"""
+# Resident sampler for push mode: one awk process polls the subtree every $1
+# seconds and prints a qmibtree line only when the value changed, numeric
+# values only once they moved more than $2 percent from the last one printed.
+PUSH_SCRIPT="""#!/bin/sh
+# ptsp01 push states v1
+[ -f /tmp/pushStates.pid ] && kill $(cat /tmp/pushStates.pid) 2>/dev/null
+echo $$ >/tmp/pushStates.pid
+exec awk -v p="$1" -v db="$2" 'BEGIN {
+cmd="qmibtree -g Device.SmartPlug.Socket."
+while (1) {
+while ((cmd | getline l) > 0) {
+k=l; sub(/[( =].*/,"",k); v=l; sub(/^[^=]*= */,"",v)
+if (k ~ /[.](Voltage|Current|Power|Energy)$/ && (k in last)) { d=v-last[k]; t=db/100*last[k]; if (d*d<=t*t) continue }
+if (!(k in last) || last[k]!=v) { last[k]=v; print l; fflush() }
+}
+close(cmd)
+system("sleep " p)
+}}'
+"""
+SAMPLE_PREFIX="PTSPS|"
+SAMPLE_ITEMS=("Current","Power")
+# Resident sampler for sample mode: every $1 seconds one awk process appends a
+# "PTSPS|<seq>|1.Current=0.27|1.Power=60.1|..." line to a ring of two files of
+# $2 lines each in /tmp, so the newest $2..2*$2 samples can be read in one cat.
+SAMPLE_SCRIPT="""#!/bin/sh
+# ptsp01 sampler v1
+[ -f /tmp/sampleStates.pid ] && kill $(cat /tmp/sampleStates.pid) 2>/dev/null
+echo $$ >/tmp/sampleStates.pid
+rm -f /tmp/samples.0 /tmp/samples.1
+exec awk -v p="$1" -v n="$2" 'BEGIN {
+cmd="qmibtree -g Device.SmartPlug.Socket."
+while (1) {
+r="PTSPS|" ++s
+while ((cmd | getline l) > 0) {
+k=l; sub(/[( =].*/,"",k); sub(/^Device[.]SmartPlug[.]Socket[.]/,"",k)
+if (k !~ /[.](Current|Power)$/) continue
+v=l; sub(/^[^=]*= */,"",v); r=r "|" k "=" v
+}
+close(cmd)
+print r >>"/tmp/samples.0"; close("/tmp/samples.0")
+if (s%n==0) system("mv /tmp/samples.0 /tmp/samples.1")
+system("usleep " int(p*1000000))
+}}'
+"""
+
+SESSION_MAGIC=b"PTSP01R1"
+SESSION_RECORD=struct.Struct("<dBI")    # seconds since the start, direction, length
+
+FRAME_START="@@S"
+FRAME_END="@@E"
+PRIORITY_CONTROL=0
+PRIORITY_POLL=1
+
+class LineFramer:
+    """Splits the received byte stream into \\r\\n terminated lines.
+
+    Bytes are appended to one bytearray and every byte is searched for a line
+    end only once. Complete lines are decoded in one pass and split as text,
+    the unterminated tail stays as bytes. Most reads end mid-line, those
+    return before any copy.
+    """
+    def __init__(self,max_buffer:int=65536) -> None:
+        self.buffer=bytearray()
+        self.max_buffer=max_buffer
+        self.overflows=0
+        self.__scanned=0    # where the search for the next line end starts
+    def feed(self,data:bytes):
+        self.buffer+=data
+        if len(self.buffer)>self.max_buffer:    # no line end for too long, keep the tail for prompt detection
+            del self.buffer[:len(self.buffer)-self.max_buffer]
+            self.__scanned=0
+            self.overflows+=1
+    @property
+    def at_prompt(self)->bool:
+        return self.buffer.endswith(PROMPT_BYTES)
+    def lines(self)->Iterable[str]:
+        """Take every complete line out of the buffer, searching only new bytes."""
+        buffer=self.buffer
+        end=buffer.rfind(b"\r\n",self.__scanned)
+        if end<0:
+            self.__scanned=len(buffer)-1 if buffer else 0   # a trailing \r may still get its \n
+            return ()
+        text=buffer[:end].decode("utf-8","replace")
+        del buffer[:end+2]
+        self.__scanned=len(buffer)-1 if buffer else 0
+        return text.split("\r\n")
+    def clear(self):
+        self.buffer.clear()
+        self.__scanned=0
+
+class Command:
+    """A command framed by start/end sentinels, resolved when its end sentinel arrives."""
+    def __init__(self,id:int,command:str,priority:int=PRIORITY_CONTROL,heredoc:str="") -> None:
+        self.id=id
+        self.command=command
+        self.heredoc=heredoc    # here-document body and terminator, sent after the command line
+        self.priority=priority
+        self.timeout:float|None=None    # seconds from sending to the end sentinel
+        self.deadline:asyncio.Timeout|None=None
+        self.lines:list[str]=[]
+        self.exit_code:int|None=None
+        self.queued=time.monotonic()
+        self.sent:float|None=None
+        self.finished:float|None=None
+        self.future:asyncio.Future=asyncio.get_running_loop().create_future()
+    @property
+    def framed(self)->str:
+        return f"echo {FRAME_START}{self.id}; {self.command}; echo {FRAME_END}{self.id}:$?\n{self.heredoc}"
+    @property
+    def latency(self)->float|None:
+        """Seconds from queueing to the end sentinel."""
+        return self.finished-self.queued if self.finished is not None else None
+    def __lt__(self,other:"Command")->bool:
+        return (self.priority,self.id)<(other.priority,other.id)
+    def finish(self,exit_code:int):
+        self.exit_code=exit_code
+        self.finished=time.monotonic()
+        if not self.future.done():
+            self.future.set_result(self)
+
+class Histogram:
+    """Observations counted in fixed buckets, cheap enough to update for every command."""
+    BOUNDS=(0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)     # seconds
+    def __init__(self,bounds:tuple[float,...]=BOUNDS) -> None:
+        self.bounds=bounds
+        self.counts=[0]*(len(bounds)+1)     # the last bucket holds everything above the bounds
+        self.count=0
+        self.total=0.0
+        self.max=0.0
+        self.last:float|None=None
+    def observe(self,value:float):
+        self.counts[bisect.bisect_left(self.bounds,value)]+=1
+        self.count+=1
+        self.total+=value
+        self.max=max(self.max,value)
+        self.last=value
+    @property
+    def mean(self)->float|None:
+        return self.total/self.count if self.count else None
+    def quantile(self,q:float)->float|None:
+        """Upper bound of the bucket holding the q quantile, max if it is above every bound."""
+        if not self.count:
+            return None
+        rank=q*self.count
+        seen=0
+        for bound,count in zip(self.bounds,self.counts):
+            seen+=count
+            if seen>=rank:
+                return min(bound,self.max)
+        return self.max
+    def as_dict(self)->dict[str,Any]:
+        return {"count":self.count,"last":self.last,"mean":self.mean,"p50":self.quantile(0.5),"p95":self.quantile(0.95),"max":self.max,
+                "buckets":{f"le_{bound}":count for bound,count in zip(self.bounds,self.counts)}|{"inf":self.counts[-1]}}
+
+def percentile(values:list[float],q:float)->float:
+    """Nearest rank q quantile of sorted values."""
+    return values[min(max(math.ceil(q*len(values))-1,0),len(values)-1)]
+
+class Metrics:
+    """Counters of one connection, kept across reconnects."""
+    def __init__(self) -> None:
+        self.poll_rtt=Histogram()           # one poll cycle, all requests of it
+        self.command_latency=Histogram()    # queueing to end sentinel of every framed command
+        self.bytes_received=0
+        self.lines=0
+        self.readings=0                     # values stored from status lines
+        self.parse_failures=0               # status lines or values that could not be used
+        self.reconnects=0
+        self.last_reading:float|None=None   # monotonic
+    @property
+    def since_last_reading(self)->float|None:
+        return time.monotonic()-self.last_reading if self.last_reading is not None else None
+    def as_dict(self)->dict[str,Any]:
+        return {"poll_rtt":self.poll_rtt.as_dict(),"command_latency":self.command_latency.as_dict(),
+                "bytes_received":self.bytes_received,"lines":self.lines,"readings":self.readings,
+                "parse_failures":self.parse_failures,"reconnects":self.reconnects,"since_last_reading":self.since_last_reading}
+
+class SessionRecorder:
+    """Writes the raw byte stream of a connection to a file, for replay.
+
+    The file is the SESSION_MAGIC header followed by one record per read
+    or write: SESSION_RECORD (seconds since the start, direction, length)
+    and the bytes. Writes go through a buffered file, flushed on close.
+    Credentials are masked by the caller, see ptsp01.send.
+    """
+    READ=0
+    WRITE=1
+    def __init__(self,path:str) -> None:
+        self.file=open(path,"wb")
+        self.file.write(SESSION_MAGIC)
+        self.started=time.monotonic()
+    def record(self,direction:int,data:bytes):
+        self.file.write(SESSION_RECORD.pack(time.monotonic()-self.started,direction,len(data)))
+        self.file.write(data)
+    def close(self):
+        self.file.close()
+
+def readSession(path:str)->Iterator[tuple[float,int,bytes]]:
+    """(seconds since the start, direction, bytes) of every record in a recorded session."""
+    with open(path,"rb") as file:
+        if file.read(len(SESSION_MAGIC))!=SESSION_MAGIC:
+            raise ValueError(f"{path} is not a recorded session")
+        while header:=file.read(SESSION_RECORD.size):
+            timestamp,direction,length=SESSION_RECORD.unpack(header)
+            yield timestamp,direction,file.read(length)
+
+class Series:
+    """Time series of one reading in contiguous array('d') of at most 2*size samples.
+
+    Running sums of the values, their squares and the trapezoid integral are
+    kept next to the samples, so the mean, standard deviation and integral of
+    any window cost two bisects and a few subtractions. When full, the older
+    half is dropped in one slice and the sums are rebased, appending stays
+    O(1) amortized. Peak and min still take a pass over the window.
+    """
+    __slots__=("size","times","values","sums","squares","integrals")
+    def __init__(self,size:int=720) -> None:
+        self.size=size
+        self.times=array.array("d")
+        self.values=array.array("d")
+        self.sums=array.array("d")          # sums[i]: values[0]+...+values[i]
+        self.squares=array.array("d")       # the same for the squared values
+        self.integrals=array.array("d")     # integrals[i]: value*hours from times[0] to times[i]
+    def __len__(self) -> int:
+        return len(self.values)
+    def append(self,timestamp:float,value:float):
+        if len(self.values)>=2*self.size:
+            self.drop(self.size)
+        if self.values:
+            self.sums.append(self.sums[-1]+value)
+            self.squares.append(self.squares[-1]+value*value)
+            self.integrals.append(self.integrals[-1]+(value+self.values[-1])*(timestamp-self.times[-1])/7200)
+        else:
+            self.sums.append(value)
+            self.squares.append(value*value)
+            self.integrals.append(0.0)
+        self.times.append(timestamp)
+        self.values.append(value)
+    def drop(self,count:int):
+        """Forget the oldest count samples, keeping the running sums small."""
+        sums,squares,integral=self.sums[count-1],self.squares[count-1],self.integrals[count]
+        del self.times[:count]
+        del self.values[:count]
+        self.sums=array.array("d",(value-sums for value in self.sums[count:]))
+        self.squares=array.array("d",(value-squares for value in self.squares[count:]))
+        self.integrals=array.array("d",(value-integral for value in self.integrals[count:]))
+    def window(self,seconds:float,now:float|None=None)->tuple[array.array,array.array]:
+        start=bisect.bisect_left(self.times,(now if now is not None else time.monotonic())-seconds)
+        return self.times[start:],self.values[start:]
+    def aggregate(self,seconds:float,now:float|None=None,extremes:bool=True)->dict[str,float]|None:
+        """mean, standard deviation, integral (value*hours) and, with extremes, peak and min of the last seconds."""
+        start=bisect.bisect_left(self.times,(now if now is not None else time.monotonic())-seconds)
+        count=len(self.values)-start
+        if count<=0:
+            return None
+        total=self.sums[-1]-(self.sums[start-1] if start else 0.0)
+        squares=self.squares[-1]-(self.squares[start-1] if start else 0.0)
+        mean=total/count
+        result={"mean":mean,"std":math.sqrt(max(squares/count-mean*mean,0)),"integral":self.integrals[-1]-self.integrals[start]}
+        if extremes:
+            values=self.values[start:]
+            result["peak"]=max(values)
+            result["min"]=min(values)
+        return result
+
+class EnergyIntegrator:
+    """Energy in Wh integrated from power readings, anchored to the device's energy counter.
+
+    Readings are integrated with the trapezoidal rule, a gap longer than
+    max_gap (connection lost, polling stopped) is left out and covered by
+    the counter once it advances. Each reading costs a few float operations.
+    The estimate only goes backwards when the counter itself is reset.
+    """
+    __slots__=("max_gap","counter","since_counter","value","last_time","last_power")
+    def __init__(self,max_gap:float=600) -> None:
+        self.max_gap=max_gap
+        self.counter:float|None=None    # last device counter reading
+        self.since_counter=0.0          # integrated since the counter last advanced
+        self.value:float|None=None
+        self.last_time:float|None=None
+        self.last_power:float|None=None
+    def addPower(self,timestamp:float,power:float):
+        if self.last_time is not None and 0<timestamp-self.last_time<=self.max_gap:
+            self.since_counter+=(power+self.last_power)*(timestamp-self.last_time)/7200
+            estimate=(self.counter or 0)+self.since_counter
+            self.value=estimate if self.value is None else max(self.value,estimate)
+        self.last_time=timestamp
+        self.last_power=power
+    def reconcile(self,counter:float):
+        """Restart the integration from the counter when it advanced or was reset."""
+        if self.counter is None or counter>self.counter:
+            self.value=counter if self.value is None else max(self.value,counter)
+        elif counter<self.counter:
+            self.value=counter
+        else:
+            return
+        self.counter=counter
+        self.since_counter=0.0
 
 class Socket:
+    __slots__=("switch","voltage","current","power","energy","tariffs")
     def __init__(self) -> None:
-        pass
+        self.switch:bool=False
+        self.voltage:float|None=None
+        self.current:float|None=None
+        self.power:float|None=None
+        self.energy:float|None=None
+        self.tariffs:tuple[float,float]|None=None     # (peak, valley) of the energy meter
+    @property
+    def energy_meter(self)->float|None:
+        return self.tariffs[0]+self.tariffs[1] if self.tariffs is not None else None
+    @property
+    def counter_energy(self)->float|None:
+        """The larger of the two device counters, or the one that was read."""
+        if self.energy != None and self.energy_meter != None:
+            return max(self.energy,self.energy_meter)
+        return self.energy if self.energy != None else self.energy_meter
     def __str__(self) -> str:
         return f"{self.switch},U={self.voltage},I={self.current},P={self.power},W={self.energy}/{self.energy_meter}"
-    switch=False
+
+class SocketState(NamedTuple):
+    """Immutable readings of one socket as published, derived values resolved once."""
+    switch:bool=False
     voltage:float|None=None
     current:float|None=None
     power:float|None=None
-    energy:float|None=None
-    energy_meter:float|None=None
+    energy:float|None=None              # device counter, else integrated power
+    integrated_energy:float|None=None
+
+STATUS_PREFIX="Device.SmartPlug.Socket."
+# "[prompt]Device.SmartPlug.Socket.<n>.<key>(<type>) = <value>", pushed lines may follow a prompt
+STATUS_LINE=re.compile(r"(?:root@\(none\):/#)?\s*Device\.SmartPlug\.Socket\.(\d+)\.([\w.]+)[^=]*=\s*(.*)")
+ENERGY_METER_FIELD=re.compile(r"'(peakenergy|valleyenergy)'\s*:\s*'?([^',}]*)")
+
+def parseSwitch(value:str)->bool:
+    return value.strip()=="1"
+def parseTariffs(value:str)->tuple[float,float]|None:
+    """Peak and valley energy of a {'peakenergy':'1.5','valleyenergy':'0.2'} record."""
+    fields=dict(ENERGY_METER_FIELD.findall(value))
+    if "peakenergy" in fields and "valleyenergy" in fields:
+        return float(fields["peakenergy"]),float(fields["valleyenergy"])
+    return None
+def parseEnergyMeter(value:str)->float|None:
+    """Sum peak and valley energy of a {'peakenergy':'1.5','valleyenergy':'0.2'} record."""
+    tariffs=parseTariffs(value)
+    return tariffs[0]+tariffs[1] if tariffs is not None else None
+
+# MIB path suffix -> (Socket attribute, converter). A converter returning None leaves the value alone.
+STATUS_FIELDS:dict[str,tuple[str,Callable[[str],Any]]]={
+    "Switch":("switch",parseSwitch),
+    "Voltage":("voltage",float),
+    "Current":("current",float),
+    "Power":("power",float),
+    "Energy":("energy",float),
+    "EnergyMeter.SingleCount":("tariffs",parseTariffs),
+}
+STATUS_ITEMS=list(STATUS_FIELDS)
+FAST_ITEMS=("Switch","Current","Power")         # polled at the adaptive interval
+SLOW_ITEMS=("Energy","EnergyMeter.SingleCount") # counters, polled every slow_interval
+SERIES_ITEMS=("Voltage","Current","Power")      # kept as time series
+SERIES_WINDOWS={"5m":300,"1h":3600}             # attribute suffix -> seconds of the rolling windows
+SERIES_EXTREMES=("5m",)                         # windows that also get peak and min, a pass over their samples
+SERIES_MAX_SIZE=1800                            # the 1h window at 2 s polls, slower polls need fewer samples
+
+class ConnectionState(Enum):
+    DISCONNECTED="disconnected"
+    CONNECTING="connecting"
+    AUTHENTICATING="authenticating"
+    READY="ready"
+    DEGRADED="degraded"     # logged in, but the shell stopped answering in time
+
 class ptsp01:
+    """Telnet client for the PTSP01 powerstrip, running on an asyncio event loop."""
     host:str
     port:int
-    telnet:telnetlib.Telnet
-    receiver_thread:threading.Thread
-    __poller:threading.Thread
+    reader:asyncio.StreamReader|None=None
+    writer:asyncio.StreamWriter|None=None
+    receiver_task:asyncio.Task|None=None
+    __poller:asyncio.Task|None=None
     __polling:bool=False
     password:str=""
     __logged_in:bool|None=None
     __version:str=""
     update_interval:int=10
-    __stored_message:str=""
+    min_interval:float|None=None    # adaptive polling bounds, both default to update_interval
+    max_interval:float|None=None
+    slow_interval:float=300
+    adaptive_threshold:float=0.05   # relative power change between polls that counts as changing
+    sockets:int=3
+    batch_query:bool=False
+    push_mode:bool=False
+    push_deadband:float=0
+    connect_timeout:float=10
+    prompt_timeout:float=30
+    idle_timeout:float=120      # probe the shell after this long without data, catches half-open sockets
+    backoff_initial:float=1
+    backoff_max:float=300
+    state:ConnectionState=ConnectionState.DISCONNECTED
+    reconnect_task:asyncio.Task|None=None
+    command_timeout:float=10
+    pipeline_depth:int=1     # framed commands handed to the shell at once
+    switch_latency:float|None=None
+    in_poll:bool=False
+    scheduler:"PollScheduler|None"=None
+    setup_shell:bool=True       # upload helper scripts after login, off for connection probes
+    integrator_max_gap:float=600    # seconds between power readings that are still integrated
+    series_size:int|None=None   # samples kept per socket and item (twice as many at most), default: the longest window at the fastest poll
+    sample_mode:bool=False      # sample Current/Power on the strip at sample_interval, fetch them each poll
+    sample_interval:float=0.5
+    sample_buffer:int=600       # samples per ring file on the strip, two files are kept
+    recorder:SessionRecorder|None=None
+    trace:bool=False            # time the stages of every received chunk and report them to onTrace
     @property
     def version(self):
         return self.__version
-    __states={1:Socket(),2:Socket(),3:Socket()}
     @property
     def states(self):
         return self.__states
+    @property
+    def published(self)->Mapping[int,SocketState]:
+        """Consistent readings of every socket, replaced as a whole after each poll. Never modify."""
+        return self.__published
     def __init__(self,host:str,port:int=23,password:str=""):
         self.host=host
         self.port=port
         self.password=password
-        self.telnet=telnetlib.Telnet()
-        self.receiver_thread=threading.Thread(target=self.threaded_receiver,daemon=True)
-        self.__poller=threading.Thread(target=self.pollingStatus,daemon=True)
-    def connect(self):
-        self.telnet.open(self.host,self.port)
-        self.onConnect()
-        if not self.receiver_thread.is_alive():
-            self.receiver_thread.start()
-    def onConnect(self):
-        message=self.telnet.read_until("root@(none):/# ".encode(),3000).decode()
+        self.__states={socket:Socket() for socket in range(1,self.sockets+1)}     # written by the parser
+        self.__published:Mapping[int,SocketState]={socket:SocketState() for socket in self.__states}
+        self.__changed:set[int]=set()      # sockets whose readings are not published yet
+        self.timings:dict[str,float]={}     # seconds from connect() to connect/login/first_data
+        self.__connect_started=time.monotonic()
+        self.__ready=asyncio.Event()      # set while the shell is sitting at the prompt
+        self.__login_done=asyncio.Event()
+        self.__decoder=codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.framer=LineFramer()
+        self.metrics=Metrics()
+        self.__update_time=0.0     # spent in onStatusUpdate during the traced chunk
+        self.__commands:dict[int,Command]={}     # in flight, in the order they were sent
+        self.__queue:list[Command]=[]            # waiting, control before poll work
+        self.__framing:Command|None=None
+        self.__command_ids=itertools.count(1)
+        self.__due:dict[str,float]={}             # item -> monotonic time of its next poll
+        self.__wakeup=asyncio.Event()
+        self.interval:float|None=None               # current adaptive interval of FAST_ITEMS
+        self.stale:set[int]=set()      # sockets showing restored readings, no live ones yet
+        self.integrators={socket:EnergyIntegrator(self.integrator_max_gap) for socket in range(1,self.sockets+1)}
+        self.series:dict[tuple[int,str],Series]={}   # (socket, item) -> readings of SERIES_ITEMS
+        self.samples:dict[int,dict[str,dict[str,float]]]={}  # socket -> item -> min/max/mean/p50/p95/count of the last fetch
+        self.__sample_seq=0                         # newest sample already fetched
+    async def connect(self):
+        self.__logged_in=None
+        self.__login_done.clear()
+        self.__ready.clear()
+        self.framer.clear()
+        self.__decoder.reset()
+        self.timings={}
+        self.__connect_started=time.monotonic()
+        self.setState(ConnectionState.CONNECTING)
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                self.reader,self.writer=await asyncio.open_connection(self.host,self.port)
+            self.timings["connect"]=time.monotonic()-self.__connect_started
+            sock=self.writer.get_extra_info("socket")
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET,socket.SO_KEEPALIVE,1)
+            self.setState(ConnectionState.AUTHENTICATING)
+            await self.onConnect()
+        finally:
+            if not self.__logged_in:    # also closes a connection that timed out or ended before the shell prompt
+                self.closeConnection()
+        if self.__logged_in and (self.receiver_task is None or self.receiver_task.done()):
+            self.receiver_task=asyncio.create_task(self.receiver())
+        if self.__logged_in:
+            if self.setup_shell:
+                await self.putReadStatesShellScript()
+            self.__login_done.set()
+    def setState(self,state:ConnectionState):
+        if state!=self.state:
+            old,self.state=self.state,state
+            self.onStateChange(old,state)
+    def onStateChange(self,old:ConnectionState,new:ConnectionState):
+        pass
+    def startReconnect(self):
+        if self.reconnect_task is None or self.reconnect_task.done():
+            self.reconnect_task=asyncio.create_task(self.reconnect())
+    async def reconnect(self):
+        """Reconnect until logged in, waiting a random 0..initial*2^attempt (capped) before each try.
+
+        The full jitter spreads a fleet that lost power at once over the
+        backoff window instead of letting every strip retry in lockstep.
+        """
+        attempt=0
+        while not self.__logged_in:
+            delay=random.uniform(0,min(self.backoff_max,self.backoff_initial*2**attempt))
+            await asyncio.sleep(delay)
+            attempt+=1
+            self.closeConnection()
+            try:
+                await self.connect()
+                self.metrics.reconnects+=1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.onReconnectFailure(e,attempt)
+    def onReconnectFailure(self,exception:Exception,attempt:int):
+        pass
+    async def readUntilPrompt(self)->str:
+        """Read until the shell, login or failure prompt shows up."""
+        message=""
+        async with asyncio.timeout(self.prompt_timeout):
+            while not (message.endswith(PROMPT) or message.endswith(LOGIN_PROMPT)):
+                data=await self.reader.read(4096)
+                if not data:
+                    raise EOFError("Connection closed by device")
+                if self.recorder is not None:
+                    self.recorder.record(SessionRecorder.READ,data)
+                message=message+self.__decoder.decode(data)
+        return message
+    async def onConnect(self):
+        message=await self.readUntilPrompt()
         if not self.__logged_in:
-            if message.endswith("root@(none):/# "):
+            if message.endswith(PROMPT):
                 self.__logged_in=True
-                self.__stored_message=message
+                self.timings["login"]=time.monotonic()-self.__connect_started
+                self.setState(ConnectionState.READY)
+                self.__ready.set()      # this prompt was read here, the framer never sees it
                 for line in message.splitlines():
                     if line.startswith(" ATTITUDE ADJUSTMENT ("):
                         self.__version=line.split("(")[1].split(")")[0]
-                self.putReadStatesShellScript()
-            elif message.find("(none) login: ")>=0:
-                self.login()
-            elif message.find("Login incorrect")>=0:
+            elif message.find(LOGIN_INCORRECT)>=0:
                 print("Login incorrect")
                 self.__logged_in=False
+                self.__login_done.set()
                 self.onLoginFailure()
-    def login(self):
-        self.telnet.write(("root\n"+self.password+"\n").encode())
-        self.onConnect()
+            elif message.find(LOGIN_PROMPT)>=0:
+                await self.login()
+    async def login(self):
+        self.send("root\n"+self.password+"\n",recorded="root\n"+"*"*len(self.password)+"\n")
+        await self.onConnect()
     def onLoginFailure(self):
         self.closeConnection()
-    def putReadStatesShellScript(self):
+    def send(self,command:str,recorded:str|None=None):
+        """Write a command to the shell. The shell is busy until the prompt is seen again.
+
+        recorded replaces the command in a session recording, for credentials.
+        """
+        self.__ready.clear()
+        data=command.encode()
+        if self.recorder is not None:
+            self.recorder.record(SessionRecorder.WRITE,data if recorded is None else recorded.encode())
+        self.writer.write(data)
+    async def request(self,command:str,timeout:float|None=None,priority:int=PRIORITY_CONTROL,heredoc:str="")->Command:
+        """Queue a framed command and wait for all of its output.
+
+        At most pipeline_depth commands are in the shell at once, so a control
+        command queued behind poll work only waits for those to finish. The
+        sentinels tie every output line to the request that produced it. The
+        timeout starts when the command is sent, not while it waits in the queue.
+        """
+        if not self.__logged_in:
+            raise ConnectionError(f"Not logged in to {self.host}")
+        request=Command(next(self.__command_ids),command,priority,heredoc)
+        request.timeout=timeout if timeout is not None else self.command_timeout
+        heapq.heappush(self.__queue,request)
+        try:
+            async with asyncio.timeout(None) as request.deadline:
+                self.pump()
+                result=await request.future
+        except TimeoutError:
+            if self.__logged_in:
+                self.setState(ConnectionState.DEGRADED)
+            raise
+        finally:
+            self.__commands.pop(request.id,None)
+        self.metrics.command_latency.observe(result.latency)
         if self.__logged_in:
-            command="tee /tmp/readStates.sh <<EOF\n"
-            for socket in range(1,4):
-                for item in ["Switch","Voltage","Current","Power","Energy","EnergyMeter.SingleCount"]:
-                    command=command+f"qmibtree -g Device.SmartPlug.Socket.{socket}.{item}\n"
-            command=command+"EOF\n"
-            self.telnet.write(command.encode())
-            
+            self.setState(ConnectionState.READY)
+        return result
+    def pump(self):
+        """Hand queued commands to the shell while there is room in the pipeline."""
+        while self.__queue and len(self.__commands)<self.pipeline_depth and self.__logged_in:
+            request=heapq.heappop(self.__queue)
+            if request.future.done():   # timed out while queued
+                continue
+            request.sent=time.monotonic()
+            if request.deadline is not None:
+                request.deadline.reschedule(asyncio.get_running_loop().time()+request.timeout)
+            self.__commands[request.id]=request
+            self.send(request.framed)
+    async def setSwitch(self,socket:int,switch:int,timeout:float|None=None)->bool:
+        """Switch a socket and return whether the device confirmed the new state."""
+        return (await self.setSwitches({socket:switch},timeout))[socket]
+    async def setSwitches(self,switches:dict[int,int],timeout:float|None=None)->dict[int,bool]:
+        """Switch several sockets in one round trip: all sets, then all reads. Return which ones the device confirmed."""
+        command="; ".join([f"qmibtree -s Device.SmartPlug.Socket.{socket}.Switch {switch}" for socket,switch in switches.items()]+
+                          [f"qmibtree -g Device.SmartPlug.Socket.{socket}.Switch" for socket in switches])
+        request=await self.request(command,timeout)
+        self.switch_latency=request.latency
+        self.publish(set(switches))     # shown right away, even in the middle of a poll
+        self.onSwitched(set(switches))
+        self.boost()
+        return {socket:self.__states[socket].switch==(switch==1) for socket,switch in switches.items()}
+    def helperScripts(self)->dict[str,str]:
+        """Device side scripts the current mode needs, by path on the strip."""
+        if self.push_mode:
+            return {"/tmp/pushStates.sh":PUSH_SCRIPT}
+        scripts={"/tmp/sampleStates.sh":SAMPLE_SCRIPT} if self.sample_mode else {}
+        if self.batch_query:    # otherwise every item is its own qmibtree request, no script needed
+            scripts["/tmp/readStatesBatch.sh"]=BATCH_SCRIPT
+        return scripts
+    async def deployScripts(self,scripts:dict[str,str])->list[str]:
+        """Upload the scripts that are missing on the strip or differ from ours, return their paths.
+
+        The md5sum of every file is compared with the hash of our content, so
+        a reconnect to a strip whose /tmp still holds the current scripts
+        costs one short round trip instead of the script bodies.
+        """
+        if not scripts:     # md5sum without files would read the terminal
+            return []
+        stale={path:hashlib.md5(content.encode()).hexdigest() for path,content in scripts.items()}
+        result=await self.request("md5sum "+" ".join(stale)+" 2>/dev/null")
+        for line in result.lines:
+            digest,_,path=line.strip().partition("  ")
+            if stale.get(path)==digest:
+                del stale[path]
+        for path in stale:
+            await self.request(f"tee {path} >/dev/null <<'EOF'",heredoc=scripts[path]+"EOF\n")
+        return list(stale)
+    async def putReadStatesShellScript(self):
+        if not self.__logged_in:
+            return
+        try:
+            await self.deployScripts(self.helperScripts())
+        except TimeoutError as e:
+            self.onException(e)
+            return
+        if self.push_mode:
+            self.send(f"sh /tmp/pushStates.sh {self.update_interval} {self.push_deadband} &\n")
+        elif self.sample_mode:
+            self.__sample_seq=0     # the sampler starts counting again
+            self.send(f"sh /tmp/sampleStates.sh {self.sample_interval} {self.sample_buffer} &\n")
+
     def isLoggedin(self):
         return self.__logged_in
-    def waitForLogin(self):
-        while(self.__logged_in==None):
-            time.sleep(0.1)
+    async def waitForLogin(self):
+        await self.__login_done.wait()
         return self.__logged_in
 
-    def getSwitch(self,socket:int):
-        self.telnet.write(f"qmibtree -g Device.SmartPlug.Socket.{socket}.Switch\n".encode())
-    def switch(self,socket:int,switch:int):
+    def background(self,coroutine)->asyncio.Task:
+        """Run a request in the background. Failures are left to the returned task, a missed one is not logged."""
+        task=asyncio.create_task(coroutine)
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return task
+    def getSwitch(self,socket:int)->asyncio.Task|None:
+        """Read a socket's switch in the background, through the request queue."""
+        return self.getStatusSingle(f"Device.SmartPlug.Socket.{socket}.Switch")
+    def switch(self,socket:int,switch:int)->asyncio.Task|None:
+        """Switch a socket in the background, see setSwitch."""
         if self.__logged_in:
-            command=f"qmibtree -s Device.SmartPlug.Socket.{socket}.Switch {switch}\n"
-            self.telnet.write(command.encode())
-            
+            return self.background(self.setSwitch(socket,switch))
+
     def getVoltage(self,socket:int):
-        return self.__states[socket].voltage
+        return self.__published[socket].voltage
     def getCurrent(self,socket:int):
-        return self.__states[socket].current
+        return self.__published[socket].current
     def getPower(self,socket:int):
-        return self.__states[socket].power
-    def getEnergy(self,socketIndex:int):
-        socket=self.__states[socketIndex]
-        if socket.energy != None and socket.energy_meter != None:
-            return max(socket.energy,socket.energy_meter)
-        else:
-            return socket.energy if socket.energy != None else socket.energy_meter
-    def getStatus(self):
+        return self.__published[socket].power
+    def getEnergy(self,socket:int):
+        return self.__published[socket].energy
+    def getIntegratedEnergy(self,socket:int)->float|None:
+        """Energy from the power readings, continuing from the device counter between its coarse updates."""
+        return self.__published[socket].integrated_energy
+    def publish(self,sockets:set[int]|None=None):
+        """Publish the changed (or the given) sockets with one swap of the published mapping.
+
+        Copy-on-write: unchanged sockets keep their SocketState, so readers
+        holding the old mapping still see one consistent set of readings.
+        """
+        sockets=self.__changed if sockets is None else sockets&self.__changed
+        if not sockets:
+            return
+        published=dict(self.__published)
+        for socket in sockets:
+            state=self.__states[socket]
+            integrator=self.integrators.get(socket)
+            integrated=integrator.value if integrator is not None else None
+            counter=state.counter_energy
+            published[socket]=SocketState(state.switch,state.voltage,state.current,state.power,
+                                          counter if counter is not None else integrated,integrated)
+        self.__changed-=sockets
+        self.__published=published
+    def snapshot(self)->dict[str,Any]:
+        """Readings, integrated energy and firmware version as plain JSON-able data."""
+        return {"version":self.__version,
+                "sockets":{str(socket):{name:getattr(state,name) for name in Socket.__slots__} for socket,state in self.__states.items()},
+                "integrated":{str(socket):integrator.value for socket,integrator in self.integrators.items()}}
+    def restore(self,snapshot:dict[str,Any]):
+        """Load a snapshot taken before a restart. Its readings stay in stale until a full poll replaced them."""
+        self.__version=snapshot.get("version",self.__version)
+        for socket,values in snapshot.get("sockets",{}).items():
+            if not socket.isdigit() or not 0<int(socket)<=self.sockets:
+                continue
+            state=self.__states.setdefault(int(socket),Socket())
+            for name in Socket.__slots__:
+                if name in values:
+                    setattr(state,name,tuple(values[name]) if name=="tariffs" and values[name] is not None else values[name])
+            self.stale.add(int(socket))
+            self.__changed.add(int(socket))
+        for socket,value in snapshot.get("integrated",{}).items():
+            if socket.isdigit() and int(socket) in self.integrators:
+                self.integrators[int(socket)].value=value
+        self.publish()
+    def getAggregates(self,socket:int,key:str)->dict[str,float]:
+        """Rolling aggregates of a reading over SERIES_WINDOWS, flat as "<name>_<window>". The integral is only kept for Power, as energy in Wh."""
+        series=self.series.get((socket,key))
+        if series is None:
+            return {}
+        now=time.monotonic()
+        result={}
+        for suffix,seconds in SERIES_WINDOWS.items():
+            for name,value in (series.aggregate(seconds,now,suffix in SERIES_EXTREMES) or {}).items():
+                if name=="integral":
+                    if key!="Power":
+                        continue
+                    name="energy"
+                result[f"{name}_{suffix}"]=round(value,4)
+        return result
+    def getStatus(self)->asyncio.Task|None:
+        """Poll every item once in the background, see poll()."""
         if self.__logged_in:
-            self.telnet.write("sh /tmp/readStates.sh\n".encode())
-    def getStatusSingle(self,path):
+            return self.background(self.poll())
+    def getStatusSingle(self,path:str)->asyncio.Task|None:
+        """Read one MIB path in the background, through the request queue."""
         if self.__logged_in:
-            command=f"qmibtree -g {path}\n"
-            self.telnet.write(command.encode())
-    def pollingStatus(self):
-        while(self.__polling):
-            while(not self.__stored_message.endswith("root@(none):/# ")):   # only send commands when ready
-                time.sleep(0.1)
-            self.getStatus()
-            time.sleep(self.update_interval)
+            return self.background(self.request(f"qmibtree -g {path}"))
+    @property
+    def bounds(self)->tuple[float,float]:
+        low=self.min_interval if self.min_interval is not None else self.update_interval
+        high=self.max_interval if self.max_interval is not None else self.update_interval
+        return low,max(low,high)
+    def seriesSize(self)->int:
+        """series_size, or enough samples for the longest of SERIES_WINDOWS at the fastest poll interval, at most SERIES_MAX_SIZE.
+
+        A series holds size to 2*size samples, so polling faster than every
+        2 s shortens the longest window to the newest SERIES_MAX_SIZE or more.
+        """
+        if self.series_size is not None:
+            return self.series_size
+        fastest=min(self.bounds[0],self.update_interval) if self.push_mode else self.bounds[0]
+        return min(math.ceil(max(SERIES_WINDOWS.values())/max(fastest,1)),SERIES_MAX_SIZE)
+    def metricInterval(self,item:str)->float:
+        low,high=self.bounds
+        if item in SLOW_ITEMS:
+            return max(self.slow_interval,high)
+        if item in FAST_ITEMS:
+            return self.interval if self.interval is not None else high
+        return high
+    def boost(self):
+        """Poll fast right away, e.g. after a switch command."""
+        self.interval=self.bounds[0]
+        now=time.monotonic()
+        for item in FAST_ITEMS:
+            self.__due[item]=now
+        self.__wakeup.set()
+        if self.scheduler is not None:
+            self.scheduler.wake(self)
+    def adapt(self,before:dict[int,float|None]):
+        """Shorten the interval while power changes quickly, back off while it is steady."""
+        low,high=self.bounds
+        interval=self.interval if self.interval is not None else min(max(self.update_interval,low),high)
+        changing=False
+        for socket,power in before.items():
+            after=self.__states[socket].power
+            if power is not None and after is not None and abs(after-power)>self.adaptive_threshold*max(abs(power),1):
+                changing=True
+        self.interval=max(low,interval/2) if changing else min(high,interval*1.5)
+    async def poll(self,items:list[str]|None=None):
+        """Read the given (default: all) items of every socket as low priority work, one qmibtree call per request."""
+        items=items if items is not None else STATUS_ITEMS
+        before={socket:state.power for socket,state in self.__states.items()}
+        self.in_poll=True
+        started=time.monotonic()
+        try:
+            if self.batch_query:
+                await self.request("sh /tmp/readStatesBatch.sh",priority=PRIORITY_POLL)
+            else:
+                await asyncio.gather(*(self.request(f"qmibtree -g Device.SmartPlug.Socket.{socket}.{item}",priority=PRIORITY_POLL)
+                                       for socket in range(1,self.sockets+1)
+                                       for item in items))
+            self.metrics.poll_rtt.observe(time.monotonic()-started)
+            if items==STATUS_ITEMS or self.batch_query:
+                self.stale.clear()
+        finally:
+            self.in_poll=False
+            self.publish()
+            self.onPollComplete()
+        if "Power" in items or self.batch_query:
+            self.adapt(before)
+    async def fetchSamples(self):
+        """Read the samples not seen before from the sampler's ring files in one request and summarize them.
+
+        The strip filters on the sequence number, so only new samples are sent.
+        """
+        request=await self.request(f"awk -F'|' -v s={self.__sample_seq} '$2>s' /tmp/samples.1 /tmp/samples.0 2>/dev/null",
+                                   priority=PRIORITY_POLL)
+        values:dict[tuple[int,str],list[float]]={}
+        newest=self.__sample_seq
+        for line in request.lines:
+            fields=line.strip().removeprefix(SAMPLE_PREFIX).split("|")
+            if not line.strip().startswith(SAMPLE_PREFIX) or not fields[0].isdigit() or int(fields[0])<=self.__sample_seq:
+                continue
+            newest=max(newest,int(fields[0]))
+            for field in fields[1:]:
+                path,_,value=field.partition("=")
+                socket,_,key=path.partition(".")
+                try:
+                    values.setdefault((int(socket),key),[]).append(float(value))
+                except ValueError:
+                    self.metrics.parse_failures+=1
+        self.__sample_seq=newest
+        for (socket,key),series in values.items():
+            if not 0<socket<=self.sockets or key not in SAMPLE_ITEMS:
+                continue
+            series.sort()
+            self.samples.setdefault(socket,{})[key]={"min":series[0],"max":series[-1],"mean":sum(series)/len(series),
+                                                    "p50":percentile(series,0.5),"p95":percentile(series,0.95),"count":len(series)}
+            self.onStatusUpdate(socket,"Samples")
+    def dueItems(self)->list[str]:
+        now=time.monotonic()
+        return [item for item in STATUS_ITEMS if self.__due.get(item,0)<=now]
+    async def pollOnce(self)->float:
+        """Run one poll cycle of the items that are due, return seconds until the next one."""
+        if not self.__logged_in:
+            return self.bounds[0]
+        items=STATUS_ITEMS if self.batch_query else self.dueItems()    # a batch reads everything anyway
+        try:
+            if items:
+                await self.poll(items)
+            if self.sample_mode:
+                await self.fetchSamples()
+        except Exception as e:
+            self.onException(e)
+        now=time.monotonic()
+        for item in items:
+            self.__due[item]=now+self.metricInterval(item)
+        if self.batch_query:
+            return self.metricInterval("Power")
+        return max(min(self.__due.values())-now,0)
+    async def pollingStatus(self):
+        while(self.__polling and not self.push_mode):  # in push mode the device reports changes by itself
+            await self.__ready.wait()   # only send commands when ready
+            delay=await self.pollOnce()
+            self.__wakeup.clear()
+            try:
+                async with asyncio.timeout(delay):
+                    await self.__wakeup.wait()
+            except TimeoutError:
+                pass
     def onMessage(self,message:str):
-        message=message.replace(" ","")
-        if message.startswith("Device.SmartPlug.Socket."):
-            self.parseStatus(message)
-    # Deprecated. Use read() and getMsg() instead.
-    def readLine(self):
-        return(self.telnet.read_until('\r\n'.encode(),100)).decode()
-    
-    def read(self):
-        self.__stored_message=self.__stored_message+self.telnet.read_very_eager().decode()
+        match=STATUS_LINE.match(message)
+        if match is not None:
+            self.updateState(int(match[1]),match[2],match[3])
+        elif message.lstrip().startswith(STATUS_PREFIX):
+            self.metrics.parse_failures+=1
+        elif message.find(BATCH_PREFIX)>=0:
+            self.parseBatch(message.replace(" ","").removeprefix(PROMPT.replace(" ","")))
+
+    async def read(self):
+        degraded=self.state==ConnectionState.DEGRADED
+        try:
+            async with asyncio.timeout(self.prompt_timeout if degraded else self.idle_timeout):
+                data=await self.reader.read(4096)
+        except TimeoutError:
+            if degraded:    # half-open or hung, let the receiver handle it as a lost connection
+                self.writer.transport.abort()
+                raise ConnectionError(f"{self.host} stopped answering")
+            self.setState(ConnectionState.DEGRADED)
+            self.probe()
+            return
+        if not data:
+            raise EOFError("Connection closed by device")
+        if degraded:
+            self.setState(ConnectionState.READY)
+        self.onData(data)
+    def onData(self,data:bytes):
+        """Take bytes received from the device into the line buffer."""
+        self.metrics.bytes_received+=len(data)
+        if self.recorder is not None:
+            self.recorder.record(SessionRecorder.READ,data)
+        self.framer.feed(data)
+        if self.framer.at_prompt:
+            self.__ready.set()
+    def dispatch(self):
+        """Hand every complete line in the buffer to onLine."""
+        if self.trace:
+            self.traceLines()
+        else:
+            for message in self.framer.lines():
+                self.onLine(message)
+    def startRecording(self,path:str):
+        """Record the raw byte stream to path until stopRecording, see SessionRecorder."""
+        self.stopRecording()
+        self.recorder=SessionRecorder(path)
+    def stopRecording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder=None
     def getMsg(self):
-        if self.__stored_message.find("\r\n")>-1:
-            spl=self.__stored_message.split("\r\n")
-            msg=spl[0:-1]
-            self.__stored_message=spl[-1]
+        msg=list(self.framer.lines())
+        if msg:
             return msg
     # def onMessageBlock(self,messages:str):
     #     lines=messages.split("\r\n")
@@ -141,61 +959,324 @@ class ptsp01:
     #     if update:
     #         self.onStatusUpdate()
 
-    def parseStatus(self,message):  #spaces are removed from message
-            socket=int(message[24])
-            pairstr=message[26:]
-            pair:str=pairstr.split('=')
-            if pair.__len__()<2:
+    def parseStatus(self,message):
+        match=STATUS_LINE.match(message)
+        if match is not None:
+            self.updateState(int(match[1]),match[2],match[3])
+    def parseBatch(self,message):   #one "PTSP01|<socket>.<key>=<value>|..." record, spaces removed
+        for field in message[len(BATCH_PREFIX):].split("|"):
+            path,_,value=field.partition("=")
+            socket,_,key=path.partition(".")
+            if value and socket.isdigit():
+                self.updateState(int(socket),key,value)
+    def updateState(self,socket:int,key:str,value:str):
+        field=STATUS_FIELDS.get(key)
+        if field is None:
+            return
+        try:
+            parsed=field[1](value)
+        except ValueError:
+            parsed=None
+        if parsed is None:
+            self.metrics.parse_failures+=1
+            return
+        state=self.__states.get(socket)
+        if state is None:
+            if not 0<socket<=self.sockets:
+                self.metrics.parse_failures+=1
                 return
-            value=pair[1]
-            key=pair[0].split("(")[0]
-            if key==("Switch"):
-                self.__states[socket].switch=value=="1"
-            elif key==("Voltage"):
-                self.__states[socket].voltage=float(value)
-            elif key==("Current"):
-                self.__states[socket].current=float(value)
-            elif key==("Power"):
-                self.__states[socket].power=float(value)
-            elif key==("Energy"):
-                self.__states[socket].energy=float(value)
-            elif key==("EnergyMeter.SingleCount"):
-                data=json.loads(value.replace("'",'"'))
-                if data and "peakenergy" in data and "valleyenergy" in data:
-                    energy=float(data["peakenergy"])+float(data["valleyenergy"])
-                    self.__states[socket].energy_meter=energy
+            state=self.__states[socket]=Socket()
+        setattr(state,field[0],parsed)
+        metrics=self.metrics
+        now=metrics.last_reading=time.monotonic()
+        metrics.readings+=1
+        if key in SERIES_ITEMS:
+            series=self.series.get((socket,key))
+            if series is None:
+                series=self.series[(socket,key)]=Series(self.seriesSize())
+            series.append(now,parsed)
+            if key=="Power" and socket in self.integrators:
+                self.integrators[socket].addPower(now,parsed)
+        elif key in SLOW_ITEMS and socket in self.integrators:
+            self.integrators[socket].reconcile(state.counter_energy)
+        if self.push_mode:
+            self.stale.discard(socket)
+        if "first_data" not in self.timings:
+            self.timings["first_data"]=now-self.__connect_started
+            self.onFirstData()
+        self.__changed.add(socket)
+        if not self.in_poll:    # readings of a poll are published together when it completes
+            self.publish()
+        if self.trace:
+            started=time.perf_counter()
+            self.onStatusUpdate(socket,key)
+            self.__update_time+=time.perf_counter()-started
+        else:
             self.onStatusUpdate(socket,key)
     def start_polling(self):
         self.__polling=True
-        self.__poller.start()
+        if self.push_mode:
+            return
+        if self.scheduler is not None:
+            self.scheduler.add(self)
+        elif self.__poller is None or self.__poller.done():
+            self.__poller=asyncio.create_task(self.pollingStatus())
     def stop_polling(self):
         self.__polling=False
+        if self.scheduler is not None:
+            self.scheduler.remove(self)
+        if self.__poller is not None:
+            self.__poller.cancel()
     @property
     def is_updating(self):
         return self.__polling
     def onStatusUpdate(self,socket:int,key:str):
         pass
+    def onPollComplete(self):
+        pass
+    def onSwitched(self,sockets:set[int]):
+        """Called after setSwitches published the sockets it switched."""
+        pass
+    def onFirstData(self):
+        """Called on the first reading after connecting; timings holds the startup phases."""
+        pass
     def onConnectionFailure(self,e):
         self.closeConnection()
     def onException(self,exception:Exception):
         pass
-    def threaded_receiver(self):
+    async def receiver(self):
+        """Dispatch lines from the device. Wakes only when bytes arrive."""
         while(self.__logged_in):
             try:
-                # msg = self.readLine.removesuffix('\r\n')
-                self.read()
-                msg = self.getMsg()
-                if msg:
-                    for message in msg:
-                        self.onMessage(message)
+                await self.read()
+                self.dispatch()
             except (EOFError,OSError,ConnectionError,ConnectionResetError,BrokenPipeError) as e:
-                self.onConnectionFailure(e)
                 self.__logged_in=False
+                self.onConnectionFailure(e)
             except Exception as e:
                 self.onException(e)
-            time.sleep(0.5)
+    def traceLines(self):
+        """Dispatch the received lines like receiver does, timing framing, parsing and status updates."""
+        self.__update_time=0.0
+        started=time.perf_counter()
+        lines=list(self.framer.lines())
+        framed=time.perf_counter()
+        for message in lines:
+            self.onLine(message)
+        dispatched=time.perf_counter()-framed
+        self.onTrace({"lines":len(lines),"frame":framed-started,"parse":dispatched-self.__update_time,"update":self.__update_time})
+    def onTrace(self,spans:dict[str,float]):
+        pass
+    def probe(self):
+        """Send a no-op through the shell of an idle connection; its answer counts as a sign of life."""
+        self.background(self.request(":",self.prompt_timeout))
+    def onLine(self,line:str):
+        """Track command frames, then hand the line to onMessage."""
+        self.metrics.lines+=1
+        marker=line.strip().removeprefix(PROMPT.strip()).strip()
+        if marker.startswith(FRAME_START) and marker[len(FRAME_START):].isdigit():
+            self.__framing=self.__commands.get(int(marker[len(FRAME_START):]))
+            return
+        if marker.startswith(FRAME_END):
+            id,_,exit_code=marker[len(FRAME_END):].partition(":")
+            if id.isdigit() and exit_code.isdigit():
+                request=self.__commands.pop(int(id),None)
+                if request is not None:
+                    request.finish(int(exit_code))
+                self.__framing=None
+                self.pump()
+                return
+        if self.__framing is not None and f"echo {FRAME_START}" not in line:  # skip echoes of pipelined commands
+            self.__framing.lines.append(line)
+        self.onMessage(line)
+    def failCommands(self,exception:Exception):
+        for request in [*self.__commands.values(),*self.__queue]:
+            if not request.future.done():
+                request.future.set_exception(ConnectionError(f"Connection to {self.host} {exception}"))
+        self.__commands.clear()
+        self.__queue.clear()
+        self.__framing=None
     def closeConnection(self):
         self.__logged_in=False
-        self.telnet.close()
+        self.setState(ConnectionState.DISCONNECTED)
+        self.__ready.clear()
+        self.failCommands(ConnectionError("closed"))
+        if self.writer is not None:
+            self.writer.close()
+    async def close(self):
+        """Stop polling, receiving and reconnecting, then close the connection."""
+        self.stop_polling()
+        if self.reconnect_task is not None and self.reconnect_task is not asyncio.current_task():
+            self.reconnect_task.cancel()
+        if self.receiver_task is not None and self.receiver_task is not asyncio.current_task():
+            self.receiver_task.cancel()
+        self.closeConnection()
+        self.stopRecording()
     def logMessage(self,*values):
-        print(*values)
\ No newline at end of file
+        print(*values)
+
+async def setSwitchesMany(targets:list[tuple[ptsp01,dict[int,int]]],max_concurrent:int=16,
+                          timeout:float|None=None)->list[tuple[dict[int,bool]|Exception,float]]:
+    """Run setSwitches on many strips at once, at most max_concurrent in flight.
+
+    Returns (confirmed sockets or the exception, seconds) in the order of targets.
+    """
+    semaphore=asyncio.Semaphore(max_concurrent)
+    async def run(strip:ptsp01,switches:dict[int,int]):
+        async with semaphore:
+            started=time.monotonic()
+            try:
+                result=await strip.setSwitches(switches,timeout)
+            except (TimeoutError,ConnectionError) as e:
+                result=e
+            return result,time.monotonic()-started
+    return await asyncio.gather(*(run(strip,switches) for strip,switches in targets))
+
+async def replay(path:str,strip:ptsp01,realtime:bool=False)->dict[str,float]:
+    """Feed the bytes a recorded session received through strip's receive path.
+
+    As fast as possible, or at the recorded pace with realtime. Writes are
+    only counted. Returns record, byte and line counts and the seconds taken.
+    """
+    lines=strip.metrics.lines
+    reads=received=writes=0
+    started=time.perf_counter()
+    for timestamp,direction,data in readSession(path):
+        if realtime and timestamp>time.perf_counter()-started:
+            await asyncio.sleep(timestamp-(time.perf_counter()-started))
+        if direction==SessionRecorder.WRITE:
+            writes+=1
+            continue
+        reads+=1
+        received+=len(data)
+        strip.onData(data)
+        strip.dispatch()
+    return {"reads":reads,"writes":writes,"bytes":received,"lines":strip.metrics.lines-lines,"seconds":time.perf_counter()-started}
+
+async def isPowerstrip(host:str,port:int=23,timeout:float=2.0)->bool:
+    """Whether host:port greets like a PTSP01: a shell or login prompt of the (none) host.
+
+    The ATTITUDE ADJUSTMENT banner alone is not enough, other OpenWrt
+    12.09 devices show it too, but their prompts carry a hostname.
+    """
+    try:
+        async with asyncio.timeout(timeout):
+            reader,writer=await asyncio.open_connection(host,port)
+    except (OSError,TimeoutError):
+        return False
+    data=b""
+    try:
+        async with asyncio.timeout(timeout):
+            while len(data)<8192 and not (data.endswith(PROMPT_BYTES) or data.endswith(LOGIN_PROMPT.encode())):
+                chunk=await reader.read(1024)
+                if not chunk:
+                    break
+                data+=chunk
+    except (OSError,TimeoutError):
+        pass
+    finally:
+        writer.close()
+    text=data.decode(errors="replace")
+    return text.endswith(PROMPT) or text.endswith(LOGIN_PROMPT)
+
+async def discover(network:str,ports:Iterable[int]=(23,),max_concurrent:int=64,timeout:float=2.0,
+                   exclude:Iterable[tuple[str,int]]=())->list[tuple[str,int]]:
+    """Find powerstrips among the hosts of network, at most max_concurrent connections at once.
+
+    Returns (host, port) of every match not in exclude, in address order.
+    """
+    excluded=set(exclude)
+    semaphore=asyncio.Semaphore(max_concurrent)
+    async def check(host:str,port:int)->tuple[str,int]|None:
+        async with semaphore:
+            return (host,port) if await isPowerstrip(host,port,timeout) else None
+    results=await asyncio.gather(*(check(str(host),port) for host in ipaddress.ip_network(network,strict=False).hosts()
+                                   for port in ports if (str(host),port) not in excluded))
+    return [result for result in results if result is not None]
+
+async def checkLogin(host:str,port:int=23,password:str="",timeout:float=10)->bool:
+    """Check that a powerstrip answers and accepts the password, without uploading scripts or polling."""
+    strip=ptsp01(host,port,password)
+    strip.setup_shell=False
+    strip.connect_timeout=timeout
+    strip.prompt_timeout=timeout
+    try:
+        await strip.connect()
+        return await strip.waitForLogin()==True
+    finally:
+        await strip.close()
+
+class PollScheduler:
+    """Runs the poll cycles of many strips from one task.
+
+    First polls are spread over the strips' intervals so a fleet does not
+    poll in bursts, and at most max_concurrent cycles run at once.
+    """
+    def __init__(self,max_concurrent:int=16) -> None:
+        self.max_concurrent=max_concurrent
+        self.__semaphore=asyncio.Semaphore(max_concurrent)
+        self.__heap:list[tuple[float,int,ptsp01]]=[]
+        self.__next:dict[ptsp01,float]={}     # strip -> due time of its live heap entry
+        self.__order=itertools.count()
+        self.__added=0
+        self.__wakeup=asyncio.Event()
+        self.__task:asyncio.Task|None=None
+        self.__cycles:set[asyncio.Task]=set()
+        self.__closed=False
+    def __len__(self):
+        return len(self.__next)
+    def schedule(self,strip:ptsp01,due:float):
+        """Queue the strip's next cycle. run() ends once no strip is queued, so it is restarted here."""
+        if self.__closed:
+            return
+        self.__next[strip]=due
+        heapq.heappush(self.__heap,(due,next(self.__order),strip))
+        self.__wakeup.set()
+        if self.__task is None or self.__task.done():
+            self.__task=asyncio.create_task(self.run())
+    def add(self,strip:ptsp01):
+        strip.scheduler=self
+        self.__closed=False
+        offset=(self.__added*0.6180339887)%1*strip.bounds[0]     # golden ratio spacing over the first interval
+        self.__added+=1
+        self.schedule(strip,time.monotonic()+offset)
+    def remove(self,strip:ptsp01):
+        self.__next.pop(strip,None)
+    def wake(self,strip:ptsp01):
+        if strip in self.__next:
+            self.schedule(strip,time.monotonic())
+    async def run(self):
+        while self.__next:
+            due,_,strip=self.__heap[0]
+            if self.__next.get(strip)!=due:     # removed or rescheduled
+                heapq.heappop(self.__heap)
+                continue
+            delay=due-time.monotonic()
+            if delay>0:
+                self.__wakeup.clear()
+                try:
+                    async with asyncio.timeout(delay):
+                        await self.__wakeup.wait()
+                except TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.__heap)
+            del self.__next[strip]
+            await self.__semaphore.acquire()
+            cycle=asyncio.create_task(self.cycle(strip))
+            self.__cycles.add(cycle)
+            cycle.add_done_callback(self.__cycles.discard)
+    async def cycle(self,strip:ptsp01):
+        delay=strip.bounds[0]
+        try:
+            delay=await strip.pollOnce()
+        finally:
+            self.__semaphore.release()
+            if strip.is_updating and strip not in self.__next:
+                self.schedule(strip,time.monotonic()+delay)
+    async def close(self):
+        self.__closed=True
+        self.__next.clear()
+        for task in [self.__task,*self.__cycles]:
+            if task is not None:
+                task.cancel()
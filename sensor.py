@@ -1,10 +1,16 @@
 """Sensors of the powerstrip."""
-from typing import Any
-from homeassistant.components.sensor import SensorEntity,SensorDeviceClass
+from typing import Any, Callable
+from homeassistant.components.sensor import SensorEntity,SensorDeviceClass,SensorStateClass
+from homeassistant.const import EntityCategory
+from .ptsp01telnet import SERIES_EXTREMES, SERIES_WINDOWS, Metrics
 from .hub import Hub,OutletDevice
 from .const import DOMAIN
 import math
+import time
 
+# Attributes of the rolling aggregates, they change with every write and are kept out of the recorder
+AGGREGATE_ATTRIBUTES = frozenset([f"{name}_{window}" for name in ("mean","std","energy") for window in SERIES_WINDOWS]+
+                                 [f"{name}_{window}" for name in ("peak","min") for window in SERIES_EXTREMES])
 
 # See cover.py for more details.
 # Note how both entities for each roller sensor (battry and illuminance) are added at
@@ -28,6 +34,16 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
         w=EnergySensor(outlet)
         new_devices.append(w)
         outlet.energy_sensor=w
+        e=IntegratedEnergySensor(outlet)
+        new_devices.append(e)
+        outlet.integrated_energy_sensor=e
+        if hub.strip.sample_mode:
+            for item,stat in SAMPLE_SENSORS:
+                sample=SampleSensor(outlet,item,stat)
+                new_devices.append(sample)
+                outlet.sample_sensors.append(sample)
+    for key,(name,unit,state_class,value) in METRIC_SENSORS.items():
+        new_devices.append(MetricSensor(hub,key,name,unit,state_class,value))
     if new_devices:
         async_add_entities(new_devices)
 
@@ -39,7 +55,13 @@ class SensorBase(SensorEntity):
     """Base representation of a Sensor."""
 
     should_poll = False
+    # Changes smaller than this are not written to HA
+    deadband:float = 0
+    # Reading whose rolling aggregates are shown as attributes
+    series_item:str|None = None
+    _unrecorded_attributes = AGGREGATE_ATTRIBUTES
     _state:Any
+    _last_written:tuple|None = None
     def __init__(self, outlet:OutletDevice):
         """Initialize the sensor."""
         self._outlet = outlet
@@ -65,6 +87,15 @@ class SensorBase(SensorEntity):
         """Entity being removed from hass."""
         # The opposite of async_added_to_hass. Remove any registered call backs here.
         self._outlet.remove_callback(self.async_write_ha_state)
+    def changed(self) -> bool:
+        """Return True if the state moved past the deadband since the last write."""
+        current=((self.available,self._outlet.stale),self.native_value)
+        if self._last_written is not None and self._last_written[0]==current[0]:
+            old,new=self._last_written[1],current[1]
+            if old==new or (old is not None and new is not None and abs(new-old)<self.deadband):
+                return False
+        self._last_written=current
+        return True
     @property
     def native_value(self):
         """Return the state of the sensor."""
@@ -77,12 +108,23 @@ class SensorBase(SensorEntity):
     def raw_value(self):
         """Return the state of the sensor."""
         return None
+    @property
+    def extra_state_attributes(self):
+        """Rolling aggregates from the running sums of the outlet's time series, computed when the state is written."""
+        if not self.available:
+            return None
+        attributes=self._outlet.aggregates(self.series_item) if self.series_item is not None else {}
+        if self._outlet.stale:
+            attributes["stale"]=True
+        return attributes or None
 
 
 class VoltageSensor(SensorBase):
     """Representation of a Sensor."""
     device_class = SensorDeviceClass.VOLTAGE
     native_unit_of_measurement = "V"
+    deadband = 0.5
+    series_item = "Voltage"
 
     def __init__(self, outlet):
         """Initialize the sensor."""
@@ -99,6 +141,8 @@ class CurrentSensor(SensorBase):
     """Representation of a Sensor."""
     device_class = SensorDeviceClass.CURRENT
     native_unit_of_measurement = "A"
+    deadband = 0.01
+    series_item = "Current"
 
     def __init__(self, outlet):
         """Initialize the sensor."""
@@ -114,6 +158,8 @@ class PowerSensor(SensorBase):
     """Representation of a Sensor."""
     device_class = SensorDeviceClass.POWER
     native_unit_of_measurement = "W"
+    deadband = 0.5
+    series_item = "Power"
 
     def __init__(self, outlet):
         """Initialize the sensor."""
@@ -129,6 +175,9 @@ class EnergySensor(SensorBase):
     """Representation of a Sensor."""
     device_class = SensorDeviceClass.ENERGY
     native_unit_of_measurement = "Wh"
+    # With external statistics the hourly history comes from there, the state is only written this often
+    statistics_write_interval = 3600
+    _written_at:float = 0
 
     def __init__(self, outlet):
         """Initialize the sensor."""
@@ -136,7 +185,103 @@ class EnergySensor(SensorBase):
         self._attr_unique_id = f"{self._outlet._id}_energy"
         # The name of the entity
         self._attr_name = f"{self._outlet.name} Energy"
+    def changed(self) -> bool:
+        """Throttle state writes while external statistics carry the energy history."""
+        if self._outlet.hub.statistics is not None and self._last_written is not None and self._last_written[0]==(self.available,self._outlet.stale) \
+                and time.monotonic()-self._written_at<self.statistics_write_interval:
+            return False
+        if not super().changed():
+            return False
+        self._written_at=time.monotonic()
+        return True
+    @property
+    def raw_value(self):
+        """Return the state of the sensor."""
+        return self._outlet.energy
+class IntegratedEnergySensor(SensorBase):
+    """Energy integrated from the power readings between the device counter's coarse steps."""
+    device_class = SensorDeviceClass.ENERGY
+    state_class = SensorStateClass.TOTAL_INCREASING
+    native_unit_of_measurement = "Wh"
+    deadband = 0.01
+
+    def __init__(self, outlet):
+        """Initialize the sensor."""
+        super().__init__(outlet)
+        self._attr_unique_id = f"{self._outlet._id}_integrated_energy"
+        # The name of the entity
+        self._attr_name = f"{self._outlet.name} Integrated energy"
     @property
     def raw_value(self):
         """Return the state of the sensor."""
-        return self._outlet.energy
\ No newline at end of file
+        return self._outlet.integrated_energy
+
+SAMPLE_SENSORS=[(item,stat) for item in ("Power","Current") for stat in ("min","max","mean","p95")]
+class SampleSensor(SensorBase):
+    """Statistic of the high-frequency samples the strip took since the last poll."""
+    UNITS={"Power":("W",SensorDeviceClass.POWER),"Current":("A",SensorDeviceClass.CURRENT)}
+
+    def __init__(self, outlet, item:str, stat:str):
+        """Initialize the sensor."""
+        super().__init__(outlet)
+        self._item = item
+        self._stat = stat
+        self._attr_native_unit_of_measurement, self._attr_device_class = self.UNITS[item]
+        self._attr_unique_id = f"{self._outlet._id}_{item.lower()}_{stat}"
+        self._attr_name = f"{self._outlet.name} {item} {stat}"
+    @property
+    def raw_value(self):
+        """Return the state of the sensor."""
+        return self._outlet.sample(self._item, self._stat)
+
+# key -> (name, unit, state class, value from the strip's metrics)
+METRIC_SENSORS:dict[str,tuple[str,str|None,SensorStateClass,Callable[[Metrics],Any]]]={
+    "poll_rtt":("Poll round trip","s",SensorStateClass.MEASUREMENT,lambda metrics: metrics.poll_rtt.last),
+    "command_latency":("Command latency","s",SensorStateClass.MEASUREMENT,lambda metrics: metrics.command_latency.last),
+    "bytes_received":("Bytes received","B",SensorStateClass.TOTAL_INCREASING,lambda metrics: metrics.bytes_received),
+    "lines":("Lines received",None,SensorStateClass.TOTAL_INCREASING,lambda metrics: metrics.lines),
+    "parse_failures":("Parse failures",None,SensorStateClass.TOTAL_INCREASING,lambda metrics: metrics.parse_failures),
+    "reconnects":("Reconnects",None,SensorStateClass.TOTAL_INCREASING,lambda metrics: metrics.reconnects),
+    "since_last_reading":("Since last reading","s",SensorStateClass.MEASUREMENT,lambda metrics: metrics.since_last_reading),
+}
+class MetricSensor(SensorEntity):
+    """Diagnostic counter of the connection to the powerstrip, read from its metrics every scan interval."""
+    entity_category = EntityCategory.DIAGNOSTIC
+    entity_registry_enabled_default = False
+    should_poll = True
+
+    def __init__(self, hub:Hub, key:str, name:str, unit:str|None, state_class:SensorStateClass, value:Callable[[Metrics],Any]):
+        """Initialize the sensor."""
+        self._hub = hub
+        self._value = value
+        self._attr_unique_id = f"{hub._id}_{key}"
+        self._attr_name = f"{hub._name} {name}"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_state_class = state_class
+        if unit=="s":
+            self._attr_device_class = SensorDeviceClass.DURATION
+        elif unit=="B":
+            self._attr_device_class = SensorDeviceClass.DATA_SIZE
+        self._histogram = getattr(hub.strip.metrics, key, None) if key in ("poll_rtt","command_latency") else None
+
+    @property
+    def device_info(self):
+        """The strip itself, the outlets are devices of their own."""
+        return {
+            "identifiers": {(DOMAIN, self._hub._id)},
+            "name": self._hub._name,
+            "sw_version": self._hub.firmware_version,
+            "model": "PTSP01",
+            "manufacturer": self._hub.manufacturer,
+        }
+    @property
+    def native_value(self):
+        """Return the state of the sensor."""
+        return self._value(self._hub.strip.metrics)
+    @property
+    def extra_state_attributes(self):
+        """Distribution of the histogram behind the latency sensors."""
+        if self._histogram is None:
+            return None
+        return {"mean":self._histogram.mean,"p50":self._histogram.quantile(0.5),"p95":self._histogram.quantile(0.95),
+                "max":self._histogram.max,"count":self._histogram.count}
@@ -44,6 +44,7 @@ class OutletEntity(SwitchEntity):
     # Our dummy class is PUSH, so we tell HA that it should not be polled
     should_poll = False
     device_class = SwitchDeviceClass.OUTLET
+    _last_written:tuple|None = None
 
     def __init__(self, outlet:OutletDevice) -> None:
         """Initialize the sensor."""
@@ -114,14 +115,25 @@ class OutletEntity(SwitchEntity):
     def available(self) -> bool:
         """Return True if roller and hub is available."""
         return self._outlet.hub.online
+    def changed(self) -> bool:
+        """Return True if availability or switch state differ from the last write."""
+        current=(self.available,self._outlet.stale,self.is_on)
+        if current==self._last_written:
+            return False
+        self._last_written=current
+        return True
+    @property
+    def extra_state_attributes(self):
+        """Mark a state restored at startup until the first poll."""
+        return {"stale":True} if self._outlet.stale else None
     @property
     def is_on(self) -> bool:
         """Return True if roller and hub is available."""
         return self._outlet.is_on==True
-    def turn_on(self, **kwargs: Any) -> None:
-        self._outlet.turn_on()
-        self.schedule_update_ha_state()
-    def turn_off(self, **kwargs: Any) -> None:
-        self._outlet.turn_off()
-        self.schedule_update_ha_state()
+    async def async_turn_on(self, **kwargs: Any) -> None:
+        await self._outlet.turn_on()
+        self.async_write_ha_state()
+    async def async_turn_off(self, **kwargs: Any) -> None:
+        await self._outlet.turn_off()
+        self.async_write_ha_state()
 
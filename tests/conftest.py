@@ -0,0 +1,5 @@
+"""The client and the simulator are plain modules, importable without Home Assistant."""
+import os
+import sys
+
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),".."))
@@ -0,0 +1,237 @@
+"""The client against the simulator: scheduling, timeouts and what gets published."""
+import asyncio
+import time
+
+from ptsp01sim import SimulatorServer
+from ptsp01telnet import PollScheduler,ptsp01
+
+class Strip(ptsp01):
+    def __init__(self,port:int):
+        super().__init__("127.0.0.1",port)
+        self.polls=0
+    def onPollComplete(self):
+        self.polls+=1
+
+async def connected(server:SimulatorServer,**settings)->Strip:
+    await server.start()
+    strip=Strip(server.port)
+    for name,value in settings.items():
+        setattr(strip,name,value)
+    await strip.connect()
+    assert await strip.waitForLogin()
+    return strip
+
+async def stop(server:SimulatorServer,*strips:ptsp01):
+    for strip in strips:
+        await strip.close()
+    await server.stop()
+
+def test_scheduler_keeps_polling_a_single_strip():
+    async def run():
+        server=SimulatorServer()
+        strip=await connected(server,update_interval=0.2,batch_query=True)
+        strip.scheduler=PollScheduler()
+        strip.start_polling()
+        await asyncio.sleep(1.5)
+        await stop(server,strip)
+        await strip.scheduler.close()
+        return strip.polls
+    assert asyncio.run(run())>=5
+
+def test_command_timeout_starts_when_sent():
+    """18 single item requests of 0.1 s each are queued at once, each one alone is well within 1 s."""
+    async def run():
+        server=SimulatorServer(exec_delay=0.1)
+        strip=await connected(server,command_timeout=1.0)
+        started=time.monotonic()
+        await strip.poll()
+        elapsed=time.monotonic()-started
+        state=strip.state
+        await stop(server,strip)
+        return elapsed,state
+    elapsed,state=asyncio.run(run())
+    assert elapsed>1.0
+    assert state.value=="ready"
+
+def test_command_timeout_of_a_hung_command():
+    async def run():
+        server=SimulatorServer(exec_delay=0.5)
+        strip=await connected(server,command_timeout=0.2)
+        try:
+            await strip.request("qmibtree -g Device.SmartPlug.Socket.1.Power")
+        except TimeoutError:
+            return strip.state.value
+        finally:
+            await stop(server,strip)
+    assert asyncio.run(run())=="degraded"
+
+def test_readings_of_a_poll_are_published_together():
+    strip=Strip(0)
+    strip.in_poll=True
+    strip.onMessage("Device.SmartPlug.Socket.1.Switch(bool) = 1")
+    strip.onMessage("Device.SmartPlug.Socket.1.Power(string) = 60.1")
+    assert strip.published[1].switch is False and strip.published[1].power is None
+    strip.in_poll=False
+    strip.publish()
+    assert strip.published[1].switch is True and strip.published[1].power==60.1
+
+def test_switching_during_a_poll_is_published_right_away():
+    async def run():
+        server=SimulatorServer(exec_delay=0.05)
+        strip=await connected(server)
+        poll=asyncio.create_task(strip.poll())
+        await asyncio.sleep(0.2)
+        assert strip.in_poll
+        assert await strip.setSwitch(2,0)
+        published=strip.published[2].switch,strip.in_poll
+        await poll
+        await stop(server,strip)
+        return published
+    assert asyncio.run(run())==(False,True)
+
+def test_only_scripts_in_use_are_deployed():
+    async def run(**settings):
+        server=SimulatorServer()
+        strip=await connected(server,**settings)
+        files=sorted(server.strip.files)
+        await stop(server,strip)
+        return files
+    assert asyncio.run(run())==[]
+    assert asyncio.run(run(batch_query=True))==["/tmp/readStatesBatch.sh"]
+    assert asyncio.run(run(push_mode=True))==["/tmp/pushStates.sh"]
+
+def test_sample_fetch_transfers_only_new_samples():
+    async def run():
+        server=SimulatorServer()
+        strip=await connected(server,sample_mode=True,sample_interval=0.02,sample_buffer=50)
+        await asyncio.sleep(0.5)
+        await strip.fetchSamples()
+        first=strip.samples[1]["Power"]["count"]
+        await asyncio.sleep(0.3)
+        files=server.strip.files
+        stored=len(files.get("/tmp/samples.0","").splitlines())+len(files.get("/tmp/samples.1","").splitlines())
+        lines=strip.metrics.lines
+        await strip.fetchSamples()
+        received=strip.metrics.lines-lines
+        second=strip.samples[1]["Power"]["count"]
+        await stop(server,strip)
+        return first,second,stored,received
+    first,second,stored,received=asyncio.run(run())
+    assert first>=10 and second>=5
+    assert received<=second+4 and received<stored      # the new samples, the echo and the frame lines
+
+def test_poller_without_scheduler_in_default_mode():
+    async def run():
+        server=SimulatorServer()
+        strip=await connected(server,update_interval=0.2)
+        strip.start_polling()
+        await asyncio.sleep(1.5)
+        await stop(server,strip)
+        return strip.polls
+    assert asyncio.run(run())>=4
+
+def test_get_status_polls_once():
+    async def run():
+        server=SimulatorServer()
+        strip=await connected(server)
+        await strip.getStatus()
+        await stop(server,strip)
+        return strip.polls,strip.states[1].voltage
+    polls,voltage=asyncio.run(run())
+    assert polls==1 and voltage is not None
+
+def test_failed_login_closes_the_connection():
+    async def run():
+        server=SimulatorServer(latency=0.5)
+        await server.start()
+        strip=Strip(server.port)
+        strip.prompt_timeout=0.1
+        try:
+            await strip.connect()
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError("connect() should time out")
+        closing=strip.writer.is_closing()
+        await asyncio.sleep(0.6)    # the server notices once its delay is over
+        sessions=len(server.sessions)
+        await server.stop()
+        return closing,sessions,strip.state.value
+    assert asyncio.run(run())==(True,0,"disconnected")
+
+def test_recording_masks_only_the_login_password(tmp_path):
+    from ptsp01telnet import SessionRecorder,readSession
+    path=str(tmp_path/"session.rec")
+    async def run():
+        server=SimulatorServer()
+        server.strip.password="1"
+        await server.start()
+        strip=Strip(server.port)
+        strip.password="1"
+        strip.startRecording(path)
+        await strip.connect()
+        assert await strip.waitForLogin()
+        assert await strip.setSwitch(1,0)
+        await stop(server,strip)
+    asyncio.run(run())
+    writes=b"".join(data for _,direction,data in readSession(path) if direction==SessionRecorder.WRITE)
+    assert writes.startswith(b"root\n*\n")
+    assert b"qmibtree -s Device.SmartPlug.Socket.1.Switch 0" in writes
+    assert b"\n1\n" not in writes
+
+def test_discover_simulated_fleet():
+    from ptsp01sim import startFleet
+    from ptsp01telnet import discover
+    async def run():
+        servers=await startFleet(3)
+        servers[1].strip.password="secret"     # greets with the login prompt
+        async def other(reader:asyncio.StreamReader,writer:asyncio.StreamWriter):
+            writer.write(b"OpenWrt router\r\nrouter login: ")
+            await writer.drain()
+            await reader.read()
+            writer.close()
+        router=await asyncio.start_server(other,"127.0.0.1",0)
+        ports=[server.port for server in servers]+[router.sockets[0].getsockname()[1]]
+        found=await discover("127.0.0.1/32",ports,timeout=1.0)
+        excluded=await discover("127.0.0.1/32",ports,timeout=1.0,exclude=[("127.0.0.1",ports[0])])
+        router.close()
+        for server in servers:
+            await server.stop()
+        return ports,found,excluded
+    ports,found,excluded=asyncio.run(run())
+    assert found==[("127.0.0.1",port) for port in ports[:3]]
+    assert excluded==[("127.0.0.1",port) for port in ports[1:3]]
+
+def test_snapshot_round_trip():
+    import json
+    source=Strip(0)
+    source.onMessage("Device.SmartPlug.Socket.1.Switch(bool) = 1")
+    source.onMessage("Device.SmartPlug.Socket.1.Power(string) = 60.5")
+    source.onMessage("Device.SmartPlug.Socket.2.EnergyMeter.SingleCount(string) = {'peakenergy': '1.5', 'valleyenergy': '0.25'}")
+    source.integrators[3].value=42.0
+    snapshot=json.loads(json.dumps(source.snapshot()))      # as the Store saves it, tuples become lists
+    assert snapshot["sockets"]["2"]["tariffs"]==[1.5,0.25]
+    restored=Strip(0)
+    restored.restore(snapshot)
+    assert restored.states[1].switch is True and restored.states[1].power==60.5
+    assert restored.states[2].tariffs==(1.5,0.25)
+    assert restored.published[2].energy==1.75
+    assert restored.integrators[3].value==42.0
+    assert restored.stale=={1,2,3}
+    restored.restore({"sockets":{"9":{"power":1.0},"x":{}}})   # unknown sockets are ignored
+    assert 9 not in restored.states
+
+def test_old_switch_calls_go_through_the_request_queue():
+    async def run():
+        server=SimulatorServer()
+        strip=await connected(server)
+        sent=[]
+        send=strip.send
+        strip.send=lambda command,recorded=None: (sent.append(command),send(command,recorded))
+        confirmed=await strip.switch(3,0)
+        await strip.getSwitch(3)
+        await stop(server,strip)
+        return confirmed,server.strip.sockets[3].switch,sent
+    confirmed,switch,sent=asyncio.run(run())
+    assert confirmed is True and switch is False
+    assert sent and all(command.startswith("echo @@S") for command in sent)
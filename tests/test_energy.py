@@ -0,0 +1,62 @@
+"""EnergyIntegrator: trapezoid integration anchored to the device's energy counter."""
+import pytest
+
+from ptsp01telnet import EnergyIntegrator
+
+def test_trapezoid_value():
+    integrator=EnergyIntegrator()
+    integrator.addPower(0,100)
+    assert integrator.value is None
+    integrator.addPower(36,200)       # (100+200)/2 W for 36 s
+    assert integrator.value==pytest.approx(1.5)
+    integrator.addPower(72,200)
+    assert integrator.value==pytest.approx(3.5)
+
+def test_gaps_longer_than_max_gap_are_skipped():
+    integrator=EnergyIntegrator(max_gap=60)
+    integrator.addPower(0,100)
+    integrator.addPower(36,100)
+    integrator.addPower(1000,100)     # connection lost in between
+    assert integrator.value==pytest.approx(1.0)
+    integrator.addPower(1036,100)
+    assert integrator.value==pytest.approx(2.0)
+
+def test_reconcile_restarts_from_an_advancing_counter():
+    integrator=EnergyIntegrator()
+    integrator.reconcile(10.0)
+    assert integrator.value==10.0
+    integrator.addPower(0,100)
+    integrator.addPower(36,100)
+    assert integrator.value==pytest.approx(11.0)
+    integrator.reconcile(10.0)        # not advanced yet, keep integrating
+    integrator.addPower(72,100)
+    assert integrator.value==pytest.approx(12.0)
+    integrator.reconcile(12.5)
+    assert integrator.value==12.5
+    integrator.addPower(108,100)
+    assert integrator.value==pytest.approx(13.5)
+
+def test_never_goes_backwards_while_the_counter_lags():
+    integrator=EnergyIntegrator()
+    integrator.reconcile(10.0)
+    integrator.addPower(0,1000)
+    integrator.addPower(36,1000)      # estimate 20
+    integrator.reconcile(11.0)        # coarse counter behind the estimate
+    assert integrator.value==pytest.approx(20.0)
+    integrator.addPower(72,1000)      # 11+10 > 20
+    assert integrator.value==pytest.approx(21.0)
+    values=[integrator.value]
+    for step in range(1,10):
+        integrator.addPower(72+step,0)
+        values.append(integrator.value)
+    assert values==sorted(values)
+
+def test_counter_reset():
+    integrator=EnergyIntegrator()
+    integrator.reconcile(50.0)
+    integrator.addPower(0,100)
+    integrator.addPower(36,100)
+    integrator.reconcile(0.5)         # reset on the device
+    assert integrator.value==0.5
+    integrator.addPower(72,100)
+    assert integrator.value==pytest.approx(1.5)
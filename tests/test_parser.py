@@ -0,0 +1,193 @@
+"""Status parsing: values stored in Socket, multi-digit sockets, mutated device output."""
+import random
+
+import pytest
+
+from ptsp01sim import MIB_ITEMS,SimulatedStrip
+from ptsp01telnet import BATCH_PREFIX,PROMPT,LineFramer,ptsp01
+
+class Parser(ptsp01):
+    sockets=12
+    def __init__(self):
+        super().__init__("127.0.0.1")
+        self.updates:list[tuple[int,str]]=[]
+    def onStatusUpdate(self,socket:int,key:str):
+        self.updates.append((socket,key))
+
+def test_values_as_the_device_prints_them():
+    parser=Parser()
+    parser.onMessage("Device.SmartPlug.Socket.2.Switch(bool) = 1")
+    parser.onMessage("Device.SmartPlug.Socket.2.Voltage(string) = 221.4")
+    parser.onMessage("Device.SmartPlug.Socket.2.Current(string) = 0.273")
+    parser.onMessage("Device.SmartPlug.Socket.2.Power(string) = 60.1")
+    parser.onMessage("Device.SmartPlug.Socket.2.Energy(string) = 12.5")
+    parser.onMessage("Device.SmartPlug.Socket.2.EnergyMeter.SingleCount(string) = {'peakenergy': '10.25', 'valleyenergy': '3.5'}")
+    state=parser.states[2]
+    assert state.switch is True
+    assert state.voltage==221.4
+    assert state.current==0.273
+    assert state.power==60.1
+    assert state.energy==12.5
+    assert state.tariffs==(10.25,3.5)
+    assert state.energy_meter==13.75
+    assert parser.published[2].energy==13.75     # the larger counter
+    assert parser.metrics.readings==6 and parser.metrics.parse_failures==0
+    assert [key for _,key in parser.updates]==["Switch","Voltage","Current","Power","Energy","EnergyMeter.SingleCount"]
+
+def test_simulator_output():
+    strip=SimulatedStrip(sockets=3)
+    parser=Parser()
+    for socket in strip.sockets:
+        for item in MIB_ITEMS:
+            parser.onMessage(strip.get(f"Device.SmartPlug.Socket.{socket}.{item}"))
+    for socket,simulated in strip.sockets.items():
+        state=parser.states[socket]
+        assert state.switch==simulated.switch
+        assert state.tariffs==(round(simulated.peak_energy,2),round(simulated.valley_energy,2))
+        assert 217<=state.voltage<=223
+        assert 57<=state.power<=63
+
+def test_prompt_before_pushed_line():
+    parser=Parser()
+    parser.onMessage(PROMPT+"Device.SmartPlug.Socket.3.Power(string) = 7.5")
+    assert parser.states[3].power==7.5
+
+@pytest.mark.parametrize("socket",[10,11,12])
+def test_multi_digit_sockets(socket):
+    parser=Parser()
+    parser.onMessage(f"Device.SmartPlug.Socket.{socket}.Power(string) = 42.0")
+    parser.onMessage(f"Device.SmartPlug.Socket.{socket}.Switch(bool) = 1")
+    assert parser.states[socket].power==42.0
+    assert parser.states[socket].switch is True
+    assert parser.states[1].power is None and parser.states[socket//10].power is None
+
+def test_unknown_socket_is_a_parse_failure():
+    parser=Parser()
+    parser.onMessage("Device.SmartPlug.Socket.13.Power(string) = 1.0")
+    parser.onMessage("Device.SmartPlug.Socket.0.Power(string) = 1.0")
+    assert 13 not in parser.states and 0 not in parser.states
+    assert parser.metrics.parse_failures==2
+
+def test_unparsable_values_leave_the_reading_alone():
+    parser=Parser()
+    parser.onMessage("Device.SmartPlug.Socket.1.Power(string) = 60.1")
+    parser.onMessage("Device.SmartPlug.Socket.1.Power(string) = 6O.1")
+    parser.onMessage("Device.SmartPlug.Socket.1.EnergyMeter.SingleCount(string) = {'peakenergy': '1'")
+    parser.onMessage("Device.SmartPlug.Socket.1")
+    assert parser.states[1].power==60.1
+    assert parser.states[1].tariffs is None
+    assert parser.metrics.parse_failures==3
+
+def test_batch_record():
+    parser=Parser()
+    parser.onMessage(PROMPT+BATCH_PREFIX+"1.Switch= 0|1.Power= 0.0|11.Voltage= 219.8|11.EnergyMeter.SingleCount= "
+                     "{'peakenergy': '2.5', 'valleyenergy': '0.5'}")
+    assert parser.states[1].switch is False and parser.states[1].power==0.0
+    assert parser.states[11].voltage==219.8
+    assert parser.states[11].energy_meter==3.0
+
+def mutate(rng:random.Random,line:str,lines:list[str])->str:
+    """Truncate, insert, delete, replace or splice at a random position."""
+    position=rng.randrange(len(line)+1)
+    choice=rng.randrange(5)
+    if choice==0:
+        return line[:position]
+    elif choice==1:
+        return line[:position]+rng.choice("=('.|{}\r\x00 9")+line[position:]
+    elif choice==2:
+        return line[:position]+line[position+1:]
+    elif choice==3:
+        return line[:position]+chr(rng.randrange(0x20,0x3000))+line[position+1:]
+    return line[:position]+rng.choice(lines)[position:]
+
+def test_mutated_output():
+    strip=SimulatedStrip(sockets=12)
+    lines=[strip.get(f"Device.SmartPlug.Socket.{socket}.{item}") for socket in strip.sockets for item in MIB_ITEMS]
+    rng=random.Random(8)
+    parser=Parser()
+    for _ in range(20000):
+        parser.onMessage(mutate(rng,rng.choice(lines),lines))
+    assert set(parser.states)==set(range(1,13))
+    assert parser.metrics.parse_failures>0
+    for state in parser.states.values():
+        assert isinstance(state.switch,bool)
+        for value in (state.voltage,state.current,state.power,state.energy):
+            assert value is None or isinstance(value,float)
+        assert state.tariffs is None or all(isinstance(value,float) for value in state.tariffs)
+
+def test_mutated_bytes_through_the_receive_path():
+    """Corrupt bytes, split at random, still frame into lines and never stop the parser."""
+    strip=SimulatedStrip(sockets=3)
+    output=b"".join((strip.get(f"Device.SmartPlug.Socket.{socket}.{item}")+"\r\n").encode()
+                    for socket in strip.sockets for item in MIB_ITEMS)
+    rng=random.Random(7)
+    parser=Parser()
+    data=bytearray(output*200)
+    for _ in range(500):
+        data[rng.randrange(len(data))]=rng.randrange(256)
+    position=0
+    while position<len(data):
+        size=rng.choice((1,7,64,4096))
+        parser.onData(bytes(data[position:position+size]))
+        parser.dispatch()
+        position+=size
+    assert parser.metrics.lines>=18*200-500
+    assert parser.metrics.readings>=18*200-2*500
+    assert all(1<=socket<=12 for socket in parser.states)
+
+def test_series_hold_the_longest_window_at_the_fastest_poll():
+    parser=Parser()
+    parser.min_interval=2
+    parser.max_interval=60
+    assert parser.seriesSize()==1800
+    parser.min_interval=1
+    assert parser.seriesSize()==1800     # capped
+    parser.min_interval=5
+    assert parser.seriesSize()==720
+    parser.min_interval=2
+    for index in range(4000):
+        parser.updateState(1,"Power",f"{index}.0")
+    series=parser.series[(1,"Power")]
+    assert 1800<=len(series)<=3600 and series.values[-1]==3999.0
+
+def test_framer_lines_split_across_reads():
+    framer=LineFramer()
+    lines=[]
+    for data in (b"first\r",b"\nsec",b"ond\r\nthird",b"\r\n"+PROMPT.encode()):
+        framer.feed(data)
+        lines.extend(framer.lines())
+    assert lines==["first","second","third"]
+    assert framer.at_prompt
+
+def test_framer_keeps_the_tail_of_an_endless_line():
+    framer=LineFramer(max_buffer=100)
+    for _ in range(10):
+        framer.feed(b"x"*50)
+        assert list(framer.lines())==[]
+    framer.feed(b"\r\nnext\r\n")
+    assert list(framer.lines())==["x"*92,"next"]
+    assert framer.overflows==9
+
+def test_series_aggregates_match_a_direct_computation():
+    import math
+    from ptsp01telnet import Series
+    rng=random.Random(3)
+    series=Series(100)
+    samples=[]
+    for index in range(1000):
+        sample=(index*1.5,rng.uniform(50,70))
+        samples.append(sample)
+        series.append(*sample)
+    now=samples[-1][0]
+    for seconds in (30,120,1000):
+        window=[sample for sample in samples if sample[0]>=now-seconds][-len(series):]
+        values=[value for _,value in window]
+        mean=sum(values)/len(values)
+        result=series.aggregate(seconds,now)
+        assert result["mean"]==pytest.approx(mean)
+        assert result["std"]==pytest.approx(math.sqrt(sum((value-mean)**2 for value in values)/len(values)),rel=1e-6)
+        assert result["integral"]==pytest.approx(sum((window[i][1]+window[i-1][1])*(window[i][0]-window[i-1][0])
+                                                     for i in range(1,len(window)))/7200)
+        assert result["peak"]==max(values) and result["min"]==min(values)
+    assert "peak" not in series.aggregate(30,now,extremes=False)
+    assert series.aggregate(10,now+100) is None